@@ -0,0 +1,349 @@
+import logging
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from board_segment import TABLE, match_rendered, segment_board, synthetic_board
+from card_codec import NUM_CARDS
+from set_card import SetCard, find_sets
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Marks the end of the stream on a queue
+_DONE = object()
+
+
+def appearance_signatures(crops, size=(12, 8)):
+    """
+    Summarise the appearance of every crop as a tiny colour thumbnail.
+
+    Thumbnails are compared by their mean absolute difference. On a white
+    card face a difference hash flips bits under a few pixels of camera
+    shake, while the thumbnail changes little for the same card and a lot
+    for a different one.
+
+    Args:
+        crops (np.array): Card crops of shape (N, H, W, 3).
+        size (tuple): (width, height) of the thumbnails.
+
+    Returns:
+        np.array: float32 signatures of shape (N, width * height * 3).
+    """
+    thumbnails = [cv2.resize(crop, size, interpolation=cv2.INTER_AREA) for crop in crops]
+    return np.array(thumbnails, dtype=np.float32).reshape(len(crops), -1)
+
+
+class CardTracker:
+    """
+    Follows cards between frames so that only new or changed cards are classified.
+
+    A detection continues a track when its centre is within max_distance of
+    the track's last centre (relative to the card width) and its appearance
+    signature is within max_appearance_distance of the track's. Tracks that
+    are not seen for max_missed frames are dropped.
+    """
+
+    def __init__(self, classify, max_distance=0.5, max_appearance_distance=16, max_missed=5):
+        """
+        Args:
+            classify (callable): Maps a batch of crops (N, H, W, 3) to N card labels.
+            max_distance (float): Largest movement between frames, in card widths.
+            max_appearance_distance (float): Largest mean absolute change of
+                the appearance signature, in grey levels.
+            max_missed (int): Frames a track survives without a detection.
+        """
+        self.classify = classify
+        self.max_distance = max_distance
+        self.max_appearance_distance = max_appearance_distance
+        self.max_missed = max_missed
+        self.tracks = []
+        self.classified = 0
+
+    def update(self, crops, quads):
+        """
+        Match the detections of a frame to the tracks and classify the rest.
+
+        Args:
+            crops (np.array): Card crops of shape (N, H, W, 3).
+            quads (np.array): Card corners of shape (N, 4, 2).
+
+        Returns:
+            list: Card labels of the detections, in their order.
+        """
+        centres = quads.mean(axis=1)
+        widths = np.linalg.norm(quads[:, 1] - quads[:, 0], axis=1)
+        signatures = appearance_signatures(crops)
+        labels = [None] * len(crops)
+
+        # Greedy matching, nearest pairs first
+        candidates = []
+        for t, track in enumerate(self.tracks):
+            distances = np.linalg.norm(centres - track["centre"], axis=1) / widths
+            appearance_distances = np.abs(signatures - track["signature"]).mean(axis=1)
+            for d in np.flatnonzero((distances <= self.max_distance) & (appearance_distances <= self.max_appearance_distance)):
+                candidates.append((distances[d], t, d))
+        matched_tracks = set()
+        for _, t, d in sorted(candidates):
+            if t in matched_tracks or labels[d] is not None:
+                continue
+            matched_tracks.add(t)
+            track = self.tracks[t]
+            track.update(centre=centres[d], signature=signatures[d], missed=0)
+            labels[d] = track["label"]
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track["missed"] += 1
+        self.tracks = [track for track in self.tracks if track["missed"] <= self.max_missed]
+
+        new = [d for d, label in enumerate(labels) if label is None]
+        if new:
+            for d, label in zip(new, self.classify(crops[new])):
+                labels[d] = label
+                self.tracks.append({"centre": centres[d], "signature": signatures[d], "label": label, "missed": 0})
+            self.classified += len(new)
+        return labels
+
+
+def _put(stage_queue, item, drop):
+    """
+    Put an item on a bounded queue. If drop is set and the queue is full,
+    make room by dropping the oldest items instead of waiting.
+
+    Returns:
+        int: Number of items dropped.
+    """
+    if not drop:
+        stage_queue.put(item)
+        return 0
+    dropped = 0
+    while True:
+        try:
+            stage_queue.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                stage_queue.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+class BoardStream:
+    """
+    Recognise the cards and Sets on the table from a video stream.
+
+    Four threads work as a pipeline joined by bounded queues: capture reads
+    frames, detection segments them into card crops, classification tracks
+    the cards and classifies only new or changed ones, and the last stage
+    finds the Sets with set_card.find_sets. When a stage falls behind, the
+    queue before it keeps the newest frame and drops older ones, so results
+    stay current rather than lag.
+    """
+
+    def __init__(self, source, classify, drop_frames=None, queue_size=2, work_width=480, on_update=None):
+        """
+        Args:
+            source: Video file path or capture device index for
+                cv2.VideoCapture, or an iterable of BGR frames.
+            classify (callable): Maps a batch of BGR crops (N, H, W, 3) to N
+                card labels, such as SetCards or (number, shape, shading,
+                color) tuples.
+            drop_frames (bool): Drop frames under load. Defaults to True for
+                capture devices and False for files and iterables, whose
+                frames are then all processed.
+            queue_size (int): Capacity of each queue between stages.
+            work_width (int): Width of the copy contours are found on.
+            on_update (callable): Called with every new state from the set
+                finding thread.
+        """
+        self.source = source
+        self.classify = classify
+        self.drop_frames = isinstance(source, int) if drop_frames is None else drop_frames
+        self.work_width = work_width
+        self.on_update = on_update
+        self.tracker = CardTracker(classify)
+        self.frames = queue.Queue(queue_size)
+        self.detections = queue.Queue(queue_size)
+        self.boards = queue.Queue(queue_size)
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.state = {"frame": -1, "cards": [], "sets": []}
+        self.stats = {"read": 0, "dropped": 0, "processed": 0, "classified": 0}
+        self.error = None
+        self.threads = []
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def _fail(self, error):
+        """Keep the first error of any stage and stop reading frames."""
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.stop_event.set()
+
+    @staticmethod
+    def _drain(stage_queue):
+        """Consume a queue up to the end marker, so that the stage before it can finish."""
+        while stage_queue.get() is not _DONE:
+            pass
+
+    def _frames(self):
+        if isinstance(self.source, (int, str)):
+            capture = cv2.VideoCapture(self.source)
+            if not capture.isOpened():
+                raise IOError(f"Cannot open {self.source}")
+            try:
+                while True:
+                    ok, frame = capture.read()
+                    if not ok:
+                        return
+                    yield frame
+            finally:
+                capture.release()
+        else:
+            yield from self.source
+
+    # Every stage passes _DONE on even if it fails, and a failed stage
+    # keeps draining its input, so that no thread is left blocked
+
+    def _capture(self):
+        try:
+            for index, frame in enumerate(self._frames()):
+                if self.stop_event.is_set():
+                    break
+                self._count("read")
+                self._count("dropped", _put(self.frames, (index, frame), self.drop_frames))
+        except Exception as e:
+            self._fail(e)
+        finally:
+            _put(self.frames, _DONE, False)
+
+    def _detect(self):
+        try:
+            while (item := self.frames.get()) is not _DONE:
+                index, frame = item
+                crops, quads = segment_board(frame, work_width=self.work_width)
+                self._count("dropped", _put(self.detections, (index, crops, quads), self.drop_frames))
+        except Exception as e:
+            self._fail(e)
+            self._drain(self.frames)
+        finally:
+            _put(self.detections, _DONE, False)
+
+    def _classify(self):
+        try:
+            while (item := self.detections.get()) is not _DONE:
+                index, crops, quads = item
+                cards = self.tracker.update(crops, quads)
+                self.stats["classified"] = self.tracker.classified
+                self._count("dropped", _put(self.boards, (index, cards), self.drop_frames))
+        except Exception as e:
+            self._fail(e)
+            self._drain(self.detections)
+        finally:
+            _put(self.boards, _DONE, False)
+
+    def _find_sets(self):
+        try:
+            while (item := self.boards.get()) is not _DONE:
+                index, cards = item
+                state = {"frame": index, "cards": cards, "sets": find_sets(cards)}
+                with self.lock:
+                    self.state = state
+                self._count("processed")
+                if self.on_update:
+                    self.on_update(state)
+        except Exception as e:
+            self._fail(e)
+            self._drain(self.boards)
+
+    def start(self):
+        """Start the pipeline threads."""
+        for stage in (self._capture, self._detect, self._classify, self._find_sets):
+            thread = threading.Thread(target=stage, name=stage.__name__.strip("_"), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def latest(self):
+        """Return the newest state: frame index, recognised cards and Sets found."""
+        with self.lock:
+            return self.state
+
+    def stop(self):
+        """Stop reading frames and wait for the frames in flight."""
+        self.stop_event.set()
+        self.join()
+
+    def join(self):
+        """Wait until the stream ends, and raise the first error of any stage."""
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        """Process the whole stream and return the final state."""
+        self.start().join()
+        return self.latest()
+
+
+def classify_rendered(crops):
+    """classify callable for synthetic boards: the nearest rendered card."""
+    return [SetCard.from_id(int(card_id)) for card_id in match_rendered(crops)]
+
+
+def synthetic_video(num_frames=300, size=(1280, 720), num_cards=12, change_every=60, gap=10, seed=0):
+    """
+    Yield frames of a game filmed by a slightly shaking camera. Every
+    change_every frames a Set (or any three cards) is taken away and, gap
+    frames later, three new cards are dealt in its place.
+
+    Yields:
+        tuple: BGR frame and the ids of the cards on it, in reading order.
+    """
+    rng = np.random.default_rng(seed)
+    deck = list(rng.permutation(NUM_CARDS))
+    card_ids = np.array([deck.pop() for _ in range(num_cards)])
+    board = None
+    width, height = size
+    for index in range(num_frames):
+        if index and index % change_every == 0:
+            sets = find_sets([SetCard.from_id(int(card_id)) for card_id in card_ids])
+            taken = [list(card_ids).index(card.id) for card in sets[0]] if sets else rng.choice(num_cards, 3, replace=False)
+            card_ids = card_ids.copy()
+            card_ids[taken] = -1
+            board = None
+        elif index % change_every == gap and (card_ids < 0).any():
+            card_ids = np.where(card_ids < 0, [deck.pop() if card_id < 0 else card_id for card_id in card_ids], card_ids)
+            board = None
+        if board is None:
+            board, _ = synthetic_board(size=size, seed=seed, card_ids=card_ids)
+        matrix = np.float32([[1, 0, rng.normal(0, 3)], [0, 1, rng.normal(0, 3)]])
+        yield cv2.warpAffine(board, matrix, (width, height), borderValue=TABLE), card_ids[card_ids >= 0]
+
+
+def benchmark_stream(num_frames=300, size=(1280, 720)):
+    """Print the sustained frame rate of BoardStream on a synthetic video and its accuracy."""
+    frames, truth = zip(*synthetic_video(num_frames, size))
+    states = []
+    stream = BoardStream(frames, classify_rendered, on_update=states.append)
+    start = time.perf_counter()
+    state = stream.run()
+    rate = stream.stats["processed"] / (time.perf_counter() - start)
+    correct = sum(np.array_equal([card.id for card in state["cards"]], truth[state["frame"]]) for state in states)
+    print(f"BoardStream: {rate:.0f} frames/s at {size[0]}x{size[1]}, {stream.stats['classified']} cards classified "
+          f"in {stream.stats['processed']} frames, {correct} frames fully recognised, {len(state['sets'])} Sets on the last board")
+    return rate
+
+
+if __name__ == "__main__":
+    benchmark_stream()
@@ -0,0 +1,225 @@
+import logging
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import permutations
+
+from set_card import DECK, NUM_CARDS, NUM_FEATURES, THIRD_CARD, find_sets_fast
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Largest boards without a Set in 1, 2, 3 and 4 dimensions
+MAX_CAP_SIZES = {1: 2, 2: 4, 3: 9, 4: 20}
+
+ALL_CARDS = (1 << NUM_CARDS) - 1
+
+# The origin and the unit vectors of F_3^4 as card ids: an affine frame
+FRAME = (0,) + tuple(3**i for i in range(NUM_FEATURES))
+
+
+def _digits(card_id):
+    return tuple((card_id // 3**i) % 3 for i in range(NUM_FEATURES))
+
+
+def _card_id(digits):
+    return sum((d % 3) * 3**i for i, d in enumerate(digits))
+
+
+def affine_map(matrix, offset):
+    """
+    Return the card permutation x -> matrix @ x + offset over F_3^4.
+
+    Args:
+        matrix (list): Columns of the linear part, as digit tuples.
+        offset (tuple): Translation, as a digit tuple.
+
+    Returns:
+        tuple: Image id of every card id.
+    """
+    images = []
+    for card_id in range(NUM_CARDS):
+        x = _digits(card_id)
+        images.append(_card_id([offset[row] + sum(column[row] * x[i] for i, column in enumerate(matrix)) for row in range(NUM_FEATURES)]))
+    return tuple(images)
+
+
+def _frame_stabilizer():
+    """Return the 120 affine maps that permute the points of FRAME."""
+    frame = [_digits(point) for point in FRAME]
+    maps = []
+    for order in permutations(frame):
+        offset = order[0]
+        matrix = [tuple(a - b for a, b in zip(point, offset)) for point in order[1:]]
+        maps.append(affine_map(matrix, offset))
+    return maps
+
+
+def is_cap(card_ids):
+    """Return whether no three of the cards (ids 0-80) form a Set."""
+    return not find_sets_fast([DECK[card_id] for card_id in card_ids])
+
+
+def _forbid(forbidden, cap, card_id):
+    """Add card_id and every card completing a Set with it and a cap card to forbidden."""
+    thirds = THIRD_CARD[card_id]
+    forbidden |= 1 << card_id
+    for other in cap:
+        forbidden |= 1 << thirds[other]
+    return forbidden
+
+
+def _extend(cap, forbidden, candidates, size, results, max_results):
+    """
+    Depth-first search for caps of the given size extending cap.
+
+    candidates holds the cards that may still be added, all greater than
+    the last card added; forbidden holds the cards that would complete a Set.
+    """
+    if len(cap) == size:
+        results.append(tuple(sorted(cap)))
+        return max_results is not None and len(results) >= max_results
+    while candidates:
+        # Not enough cards left to reach the size: prune the branch
+        if len(cap) + candidates.bit_count() < size:
+            return False
+        lowest = candidates & -candidates
+        candidates ^= lowest
+        card_id = lowest.bit_length() - 1
+        new_forbidden = _forbid(forbidden, cap, card_id)
+        cap.append(card_id)
+        done = _extend(cap, new_forbidden, candidates & ~new_forbidden, size, results, max_results)
+        cap.pop()
+        if done:
+            return True
+    return False
+
+
+def _search_subtree(first_card, size, max_results):
+    """Search the caps containing FRAME and first_card."""
+    cap = []
+    forbidden = 0
+    for card_id in FRAME + (first_card,):
+        forbidden = _forbid(forbidden, cap, card_id)
+        cap.append(card_id)
+    results = []
+    _extend(cap, forbidden, ALL_CARDS & ~forbidden, size, results, max_results)
+    return results
+
+
+def first_card_representatives():
+    """
+    Return one card per orbit of the frame stabilizer on the cards that can
+    join FRAME in a cap.
+    """
+    forbidden = 0
+    cap = []
+    for card_id in FRAME:
+        forbidden = _forbid(forbidden, cap, card_id)
+        cap.append(card_id)
+
+    stabilizer = _frame_stabilizer()
+    representatives = []
+    seen = 0
+    for card_id in range(NUM_CARDS):
+        if (forbidden | seen) >> card_id & 1:
+            continue
+        representatives.append(card_id)
+        for images in stabilizer:
+            seen |= 1 << images[card_id]
+    return representatives
+
+
+def search_caps(size, max_results=None, workers=None):
+    """
+    Enumerate caps (boards without a Set) of a given size, up to symmetry.
+
+    A board with more than 9 cards and no Set cannot lie in a 3-dimensional
+    affine subspace, so it contains 5 affinely independent cards. The affine
+    group of F_3^4 maps any such ordered frame to FRAME, so only caps
+    containing FRAME are searched. One more card is then fixed per orbit of
+    the 120 affine maps permuting FRAME, and the rest are added in
+    increasing id order with an incremental bitmask of forbidden cards. Each
+    of these subtrees can run in its own process.
+
+    Every cap of the size is equivalent to at least one cap returned, but
+    equivalent caps may be returned more than once.
+
+    Args:
+        size (int): Number of cards, at least 10.
+        max_results (int): Stop each subtree after this many caps.
+        workers (int): Number of worker processes. None, 0 or 1 searches
+            in this process.
+
+    Returns:
+        list: Caps as sorted tuples of card ids.
+    """
+    if size <= MAX_CAP_SIZES[NUM_FEATURES - 1]:
+        raise ValueError(f"Caps of size {size} can lie in a hyperplane; the search needs at least 10 cards")
+
+    firsts = first_card_representatives()
+    if workers is None or workers <= 1:
+        results = []
+        for first_card in firsts:
+            results.extend(_search_subtree(first_card, size, max_results))
+            if max_results is not None and len(results) >= max_results:
+                break
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            subtrees = executor.map(_search_subtree, firsts, [size] * len(firsts), [max_results] * len(firsts))
+            results = [cap for subtree in subtrees for cap in subtree]
+
+    return results[:max_results] if max_results is not None else results
+
+
+def largest_cap(workers=None):
+    """
+    Find the largest board without a Set by searching increasing sizes until
+    none exists.
+
+    Args:
+        workers (int): Number of worker processes. None, 0 or 1 searches
+            in this process.
+
+    Returns:
+        tuple: Size of the largest cap and one cap of that size.
+    """
+    size = MAX_CAP_SIZES[NUM_FEATURES - 1] + 1
+    best = None
+    while True:
+        start = time.perf_counter()
+        caps = search_caps(size, max_results=1, workers=workers)
+        logger.info(f"Size {size}: {'found' if caps else 'none'} in {time.perf_counter() - start:.1f} s")
+        if not caps:
+            return size - 1, best
+        best = caps[0]
+        size += 1
+
+
+def random_affine_image(card_ids, rng=None):
+    """
+    Map cards through a random affine map of F_3^4. Boards without a Set
+    stay without a Set, which turns a cap into an adversarial test board.
+
+    Args:
+        card_ids (list): Card ids.
+        rng (random.Random): Random generator.
+
+    Returns:
+        list: SetCards of the image.
+    """
+    rng = rng or random.Random()
+    while True:
+        matrix = [tuple(rng.randrange(3) for _ in range(NUM_FEATURES)) for _ in range(NUM_FEATURES)]
+        images = affine_map(matrix, tuple(rng.randrange(3) for _ in range(NUM_FEATURES)))
+        # Singular matrices do not give a permutation of the cards
+        if len(set(images)) == NUM_CARDS:
+            return [DECK[images[card_id]] for card_id in card_ids]
+
+
+if __name__ == "__main__":
+    size, cap = largest_cap(workers=0)
+    logger.info(f"Largest board without a Set: {size} cards")
+    for card in random_affine_image(cap):
+        logger.info(card)
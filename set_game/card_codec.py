@@ -0,0 +1,85 @@
+from itertools import product
+
+# Feature values in (number, shape, shading, color) order, and the one-letter
+# codes used in file names such as "1RES.jpg" (number, color, shading, shape)
+FEATURE_NAMES = ("number", "shape", "shading", "color")
+
+NUMBERS = [1, 2, 3]
+SHAPES = ["diamond", "squiggle", "oval"]
+SHADINGS = ["solid", "striped", "open"]
+COLORS = ["red", "green", "purple"]
+
+NUMBER_CODES = ["1", "2", "3"]
+SHAPE_CODES = ["D", "S", "O"]  # diamond, squiggle, oval
+SHADING_CODES = ["S", "O", "E"]  # solid, opaque (striped), empty (open)
+COLOR_CODES = ["R", "G", "P"]  # red, green, purple
+
+FEATURE_VALUES = dict(zip(FEATURE_NAMES, (NUMBERS, SHAPES, SHADINGS, COLORS)))
+
+SHAPE_BY_CODE = dict(zip(SHAPE_CODES, SHAPES))
+SHADING_BY_CODE = dict(zip(SHADING_CODES, SHADINGS))
+COLOR_BY_CODE = dict(zip(COLOR_CODES, COLORS))
+
+NUM_CARDS = 81
+
+# Lookup tables indexed by card id. The id is the card's features read as a
+# base-3 number in (number, shape, shading, color) order, as in set_card.DECK.
+FEATURES = tuple(product(NUMBERS, SHAPES, SHADINGS, COLORS))
+DIGITS = tuple(product(range(3), repeat=4))
+CODES = tuple(
+    f"{NUMBER_CODES[n]}{COLOR_CODES[c]}{SHADING_CODES[sh]}{SHAPE_CODES[s]}" for n, s, sh, c in DIGITS
+)
+NAMES = tuple(f"{number}-{color}-{shading}-{shape}" for number, shape, shading, color in FEATURES)
+
+CODE_TO_ID = {code: card_id for card_id, code in enumerate(CODES)}
+NAME_TO_ID = {name: card_id for card_id, name in enumerate(NAMES)}
+FEATURES_TO_ID = {features: card_id for card_id, features in enumerate(FEATURES)}
+
+
+def code_to_id(code):
+    """Return the card id of a short code such as "1RES"."""
+    return CODE_TO_ID[code.upper()]
+
+
+def id_to_code(card_id):
+    """Return the short code of a card id, e.g. "1RES"."""
+    return CODES[card_id]
+
+
+def name_to_id(name):
+    """Return the card id of a long name such as "1-red-open-squiggle"."""
+    return NAME_TO_ID[name.lower()]
+
+
+def id_to_name(card_id):
+    """Return the long name of a card id, e.g. "1-red-open-squiggle"."""
+    return NAMES[card_id]
+
+
+def features_to_id(features):
+    """Return the card id of a (number, shape, shading, color) tuple."""
+    return FEATURES_TO_ID[tuple(features)]
+
+
+def id_to_features(card_id):
+    """Return the (number, shape, shading, color) tuple of a card id."""
+    return FEATURES[card_id]
+
+
+def feature(card_id, feature_name):
+    """Return one feature ("number", "shape", "shading" or "color") of a card id."""
+    return FEATURES[card_id][FEATURE_NAMES.index(feature_name)]
+
+
+def parse_filename(file_name):
+    """
+    Return the card id encoded in the first four characters of a file name,
+    such as "1RES.jpg" or "1RES_<tag>.jpg".
+
+    Args:
+        file_name (str): File name, without directory.
+
+    Returns:
+        int: Card id, or None if the name does not start with a card code.
+    """
+    return CODE_TO_ID.get(file_name[:4].upper())
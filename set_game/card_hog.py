@@ -0,0 +1,346 @@
+import logging
+import os
+import time
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+from card_codec import DIGITS, FEATURE_NAMES, parse_filename
+from data_aug import IMAGE_EXTENSIONS, source_paths, stream_augmented
+from image_cache import decode_image
+from set_card import SetCard
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (width, height) crops are resized to before feature extraction: landscape,
+# like the photos in data/original, and a whole number of HOG cells
+FEATURE_SIZE = (96, 64)
+
+# Pixels with at least this HSV saturation and value are ink, not card
+INK_SATURATION = 60
+INK_VALUE = 50
+HUE_BINS = 18
+
+
+def _resize_batch(images, size=FEATURE_SIZE):
+    """Return images as one (N, height, width, 3) array of the feature size."""
+    if isinstance(images, np.ndarray) and images.shape[1:3] == (size[1], size[0]):
+        return images
+    return np.array([cv2.resize(image, size, interpolation=cv2.INTER_AREA) for image in images], dtype=np.uint8).reshape(-1, size[1], size[0], 3)
+
+
+@lru_cache(maxsize=16)
+def _cell_slots(n, height, width, cell, slots):
+    """First vote slot of every pixel's cell, for a batch of n images."""
+    cell_columns = width // cell
+    cell_index = (np.arange(height)[:, None] // cell * cell_columns + np.arange(width) // cell).reshape(-1)
+    return ((np.arange(n)[:, None] * ((height // cell) * cell_columns) + cell_index) * slots).reshape(-1)
+
+
+def hog_features(grey, cell=8, bins=9, block=2):
+    """
+    Histograms of oriented gradients of a batch of images, in one pass.
+
+    Central-difference gradients vote their magnitude into unsigned
+    orientation bins of the pixel's cell, split linearly between the two
+    nearest bin centres (no interpolation between cells). Overlapping blocks
+    of cells are then normalised with L2-Hys. This is not the same descriptor
+    as skimage.feature.hog, which votes each gradient into a single bin.
+
+    Args:
+        grey (np.array): Grey images of shape (N, H, W), with H and W
+            multiples of cell.
+        cell (int): Cell size in pixels.
+        bins (int): Orientation bins.
+        block (int): Block size in cells.
+
+    Returns:
+        np.array: float32 descriptors of shape (N, D).
+    """
+    grey = grey.astype(np.float32)
+    n, height, width = grey.shape
+    gx = np.zeros_like(grey)
+    gy = np.zeros_like(grey)
+    gx[:, :, 1:-1] = grey[:, :, 2:] - grey[:, :, :-2]
+    gy[:, 1:-1, :] = grey[:, 2:, :] - grey[:, :-2, :]
+    magnitude, angle = cv2.cartToPolar(gx.reshape(n * height, width), gy.reshape(n * height, width))
+    # Angles are in [0, 2 pi): shifted by a whole turn of bins the bin
+    # positions stay positive, so truncation floors them
+    position = angle.reshape(-1) * (bins / np.pi) + (bins - 0.5)
+    lower = position.astype(np.int32)
+    upper_weight = magnitude.reshape(-1) * (position - lower)
+    lower_weight = magnitude.reshape(-1) - upper_weight
+
+    # Vote into 3 * bins + 1 unfolded slots per cell with two weighted
+    # bincounts, then fold the slots modulo bins
+    cell_rows, cell_columns = height // cell, width // cell
+    slots = 3 * bins + 1
+    index = _cell_slots(n, height, width, cell, slots) + lower
+    size = n * cell_rows * cell_columns * slots
+    votes = np.bincount(index, lower_weight, size).reshape(-1, slots)
+    votes[:, 1:] += np.bincount(index, upper_weight, size).reshape(-1, slots)[:, :-1]
+    cells = votes[:, :bins] + votes[:, bins:2 * bins] + votes[:, 2 * bins:3 * bins]
+    cells[:, 0] += votes[:, 3 * bins]
+    cells = cells.astype(np.float32).reshape(n, cell_rows, cell_columns, bins)
+
+    rows, columns = cells.shape[1] - block + 1, cells.shape[2] - block + 1
+    blocks = np.concatenate([cells[:, i:i + rows, j:j + columns] for i in range(block) for j in range(block)], axis=3)
+    blocks /= np.sqrt((blocks**2).sum(axis=3, keepdims=True) + 1e-6)
+    np.minimum(blocks, 0.2, out=blocks)
+    blocks /= np.sqrt((blocks**2).sum(axis=3, keepdims=True) + 1e-6)
+    return blocks.reshape(n, -1)
+
+
+def colour_features(images, bgr=False):
+    """
+    Ink colour statistics of a batch of images: a hue histogram of the ink
+    pixels, the ink's mean saturation and value, and the fraction of ink,
+    which tells solid from striped from open and one symbol from three.
+
+    Args:
+        images (np.array): Images of shape (N, H, W, 3).
+        bgr (bool): Whether the images are in OpenCV's BGR channel order.
+
+    Returns:
+        np.array: float32 features of shape (N, HUE_BINS + 3).
+    """
+    n, height, width, _ = images.shape
+    # One conversion for the whole batch, stacked as a single tall image
+    hsv = cv2.cvtColor(images.reshape(n * height, width, 3), cv2.COLOR_BGR2HSV if bgr else cv2.COLOR_RGB2HSV)
+    hue, saturation, value = hsv.reshape(n, height * width, 3).transpose(2, 0, 1)
+    ink = (saturation >= INK_SATURATION) & (value >= INK_VALUE)
+    ink_count = np.maximum(ink.sum(axis=1), 1)
+
+    hue_bins = hue.astype(np.int64) * HUE_BINS // 180
+    bins = (np.arange(n)[:, None] * HUE_BINS + hue_bins)[ink]
+    histogram = np.bincount(bins, minlength=n * HUE_BINS).reshape(n, HUE_BINS) / ink_count[:, None]
+
+    mean_saturation = (saturation * ink).sum(axis=1) / ink_count / 255
+    mean_value = (value * ink).sum(axis=1) / ink_count / 255
+    fraction = ink.mean(axis=1)
+    return np.column_stack([histogram, mean_saturation, mean_value, fraction]).astype(np.float32)
+
+
+def extract_features(images, bgr=False):
+    """
+    HOG and colour features of a batch of card crops.
+
+    Args:
+        images (np.array): Crops of shape (N, H, W, 3), or a list of crops of
+            different sizes; resized to FEATURE_SIZE.
+        bgr (bool): Whether the images are in OpenCV's BGR channel order.
+
+    Returns:
+        np.array: float32 features of shape (N, D).
+    """
+    images = _resize_batch(images)
+    n, height, width, _ = images.shape
+    grey = cv2.cvtColor(images.reshape(n * height, width, 3), cv2.COLOR_BGR2GRAY if bgr else cv2.COLOR_RGB2GRAY)
+    return np.hstack([hog_features(grey.reshape(n, height, width)), colour_features(images, bgr)])
+
+
+def _softmax(logits):
+    """Softmax over the last axis."""
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def fit_softmax(features, labels, classes=3, epochs=300, learning_rate=0.05, l2=1e-2):
+    """
+    Fit one multinomial logistic regression per attribute, jointly, by
+    full-batch gradient descent with Adam. The attributes share each matrix
+    product, which is most of the cost.
+
+    Args:
+        features (np.array): Standardised features (N, D).
+        labels (np.array): Class labels of every attribute (N, A).
+        classes (int): Number of classes of each attribute.
+        epochs (int): Gradient steps.
+        learning_rate (float): Adam step size.
+        l2 (float): Weight decay.
+
+    Returns:
+        tuple: Weights (A, D, classes) and biases (A, classes).
+    """
+    n, dimensions = features.shape
+    attributes = labels.shape[1]
+    targets = np.eye(classes, dtype=np.float32)[labels]
+    params = [np.zeros((dimensions, attributes * classes), np.float32), np.zeros(attributes * classes, np.float32)]
+    moments = [np.zeros_like(p) for p in params]
+    squares = [np.zeros_like(p) for p in params]
+    for step in range(1, epochs + 1):
+        logits = (features @ params[0] + params[1]).reshape(n, attributes, classes)
+        error = ((_softmax(logits) - targets) / n).reshape(n, -1)
+        gradients = [features.T @ error + l2 * params[0], error.sum(axis=0)]
+        for p, g, m, v in zip(params, gradients, moments, squares):
+            m *= 0.9
+            m += 0.1 * g
+            v *= 0.999
+            v += 0.001 * g**2
+            p -= learning_rate * (m / (1 - 0.9**step)) / (np.sqrt(v / (1 - 0.999**step)) + 1e-8)
+    weights = params[0].reshape(dimensions, attributes, classes).transpose(1, 0, 2)
+    return np.ascontiguousarray(weights), params[1].reshape(attributes, classes)
+
+
+class CardHOGClassifier:
+    """
+    Classifies all four attributes of card crops with one small linear
+    model per attribute on shared HOG and colour features.
+
+    Everything is NumPy and OpenCV, so it needs no deep-learning runtime;
+    a board of 12-15 crops is classified in a few milliseconds.
+    """
+
+    def __init__(self, mean, scale, weights, biases, reduction=1):
+        """
+        Args:
+            mean (np.array): Feature means (D,), for standardisation.
+            scale (np.array): Feature standard deviations (D,).
+            weights (np.array): Weights (4, D, 3), in FEATURE_NAMES order.
+            biases (np.array): Biases (4, 3).
+            reduction (int): Scale divisor (1, 2, 4 or 8) the training
+                images were decoded at; predict_paths decodes the same way.
+        """
+        self.mean = mean
+        self.scale = scale
+        self.weights = weights
+        self.biases = biases
+        self.reduction = reduction
+
+    @classmethod
+    def fit(cls, images, card_ids, bgr=False, reduction=1, **kwargs):
+        """
+        Train the four attribute models.
+
+        Args:
+            images (np.array): Card crops (N, H, W, 3), or a list of crops.
+            card_ids (np.array): Card id of every crop (N,).
+            bgr (bool): Whether the images are in OpenCV's BGR channel order.
+            reduction (int): Scale divisor the images were decoded at, saved
+                with the model.
+            **kwargs: Passed to fit_softmax.
+
+        Returns:
+            CardHOGClassifier: The trained classifier.
+        """
+        features = extract_features(images, bgr)
+        mean = features.mean(axis=0)
+        scale = features.std(axis=0) + 1e-6
+        features = (features - mean) / scale
+        weights, biases = fit_softmax(features, np.array(DIGITS)[np.asarray(card_ids)], **kwargs)
+        return cls(mean, scale, weights, biases, reduction)
+
+    @classmethod
+    def fit_directory(cls, directory, reduction=8, **kwargs):
+        """
+        Train on every image under a directory whose name starts with a card
+        code, such as the data_aug output (dataset_*/<split>/<class>/).
+
+        Args:
+            directory (str): Root of the images.
+            reduction (int): Scale divisor (1, 2, 4 or 8) applied while
+                decoding, saved with the model for predict_paths.
+            **kwargs: Passed to fit_softmax.
+        """
+        paths, card_ids = find_card_images(directory)
+        images = [decode_image(path, reduction=reduction, size=FEATURE_SIZE) for path in paths]
+        logger.info(f"Training on {len(paths)} images from {directory}")
+        return cls.fit(np.array(images), card_ids, bgr=True, reduction=reduction, **kwargs)
+
+    def predict_proba(self, images, bgr=False):
+        """
+        Return the class probabilities of every attribute.
+
+        Args:
+            images (np.array): Card crops (N, H, W, 3), or a list of crops.
+            bgr (bool): Whether the images are in OpenCV's BGR channel order.
+
+        Returns:
+            np.array: Probabilities of shape (4, N, 3): attributes in
+            FEATURE_NAMES order, values in card_codec.FEATURE_VALUES order.
+        """
+        features = (extract_features(images, bgr) - self.mean) / self.scale
+        logits = np.einsum("nd,fdc->fnc", features, self.weights) + self.biases[:, None]
+        return _softmax(logits)
+
+    def predict_ids(self, images, bgr=False):
+        """Return the card id of every crop (N,)."""
+        digits = self.predict_proba(images, bgr).argmax(axis=2)
+        return ((digits[0] * 3 + digits[1]) * 3 + digits[2]) * 3 + digits[3]
+
+    def predict_batch(self, images, bgr=False):
+        """Classify a batch of card crops, returning a list of SetCards."""
+        return [SetCard.from_id(int(card_id)) for card_id in self.predict_ids(images, bgr)]
+
+    def predict_paths(self, paths):
+        """Decode card images as in training (reduction and FEATURE_SIZE) and classify them."""
+        images = [decode_image(path, reduction=self.reduction, size=FEATURE_SIZE) for path in paths]
+        return self.predict_batch(np.array(images), bgr=True)
+
+    def save(self, path):
+        """Save the models and their decode reduction as a NumPy .npz file."""
+        np.savez_compressed(path, mean=self.mean, scale=self.scale, weights=self.weights, biases=self.biases, reduction=self.reduction)
+
+    @classmethod
+    def load(cls, path):
+        """Load models saved by save."""
+        with np.load(path) as data:
+            return cls(data["mean"], data["scale"], data["weights"], data["biases"], int(data["reduction"]))
+
+
+def find_card_images(directory):
+    """
+    Return the paths and card ids of all images under a directory whose
+    file names start with a card code.
+    """
+    paths = []
+    card_ids = []
+    for root, _, files in os.walk(directory):
+        for file_name in sorted(files):
+            card_id = parse_filename(file_name)
+            if file_name.endswith(IMAGE_EXTENSIONS) and card_id is not None:
+                paths.append(os.path.join(root, file_name))
+                card_ids.append(card_id)
+    return paths, np.array(card_ids, dtype=np.int64)
+
+
+def augmented_samples(input_directory, num_batches, batch_size=81, seed=0, workers=0):
+    """
+    Draw augmented crops of the source cards with data_aug.stream_augmented,
+    without writing them to disk.
+
+    Returns:
+        tuple: RGB images (N, height, width, 3) of FEATURE_SIZE and card ids (N,).
+    """
+    stream = stream_augmented(source_paths(input_directory), label_feature=None, batch_size=batch_size, shuffle=False,
+                              num_batches=num_batches, seed=seed, workers=workers, size=FEATURE_SIZE)
+    images, card_ids = zip(*stream)
+    return np.concatenate(images), np.concatenate(card_ids)
+
+
+if __name__ == "__main__":
+    input_directory = "./data/original_compressed"
+    train_images, train_ids = augmented_samples(input_directory, num_batches=40, seed=0)
+    test_images, test_ids = augmented_samples(input_directory, num_batches=5, seed=1)
+
+    start = time.perf_counter()
+    classifier = CardHOGClassifier.fit(train_images, train_ids)
+    logger.info(f"Trained on {len(train_ids)} images in {time.perf_counter() - start:.1f} s")
+    classifier.save("./card_hog.npz")
+
+    digits = np.array(DIGITS)
+    predicted = digits[classifier.predict_ids(test_images)]
+    for f, name in enumerate(FEATURE_NAMES):
+        logger.info(f"{name}: {np.mean(predicted[:, f] == digits[test_ids, f]):.1%} correct")
+    logger.info(f"All four: {np.mean((predicted == digits[test_ids]).all(axis=1)):.1%} correct on {len(test_ids)} held-out augmentations")
+
+    board = test_images[:15]
+    classifier.predict_batch(board)
+    start = time.perf_counter()
+    for _ in range(100):
+        classifier.predict_batch(board)
+    logger.info(f"predict_batch: {(time.perf_counter() - start) * 10:.2f} ms for a board of {len(board)} cards")
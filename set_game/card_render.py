@@ -0,0 +1,206 @@
+import time
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+from card_codec import DIGITS, NUM_CARDS
+
+# Cards are drawn landscape, like the photos in data/original, with the
+# symbols standing side by side
+CARD_HEIGHT = 96
+CARD_WIDTH = 150
+
+# RGB ink colours in card_codec.COLORS order (red, green, purple)
+INK = np.array([[220, 30, 45], [20, 150, 70], [100, 40, 140]], dtype=np.float32)
+BACKGROUND = np.array([250, 250, 245], dtype=np.float32)
+
+SUPERSAMPLE = 4
+
+
+def _shape_fields(shape, height, width):
+    """
+    Return the implicit function of a symbol on a supersampled grid: a pixel
+    is inside the symbol where it is at most 1.
+    """
+    y, x = np.mgrid[0:height * SUPERSAMPLE, 0:width * SUPERSAMPLE].astype(np.float32)
+    # Coordinates in [-1, 1] across the symbol box
+    u = (x + 0.5) / (width * SUPERSAMPLE) * 2 - 1
+    v = (y + 0.5) / (height * SUPERSAMPLE) * 2 - 1
+
+    if shape == "diamond":
+        return np.abs(u) + np.abs(v)
+    if shape == "oval":
+        # A stadium: a rectangle with half-disc ends at the top and bottom
+        aspect = width / height
+        d = np.maximum(np.abs(v) - (1 - aspect), 0) / aspect
+        return np.sqrt(u**2 + d**2)
+    if shape == "squiggle":
+        # An ellipse whose centre line bends along a sine wave, pinched in the middle
+        bend = 0.35 * np.sin(np.pi * v)
+        return np.sqrt(((u - bend) / (0.7 - 0.2 * np.cos(np.pi * v) ** 2)) ** 2 + v**2)
+    raise ValueError(f"Unknown shape: {shape}")
+
+
+def symbol_masks(height, width, stroke=0.12, stripe_period=4):
+    """
+    Precompute the anti-aliased coverage of every shape and shading.
+
+    Args:
+        height (int): Height of a symbol in pixels.
+        width (int): Width of a symbol in pixels.
+        stroke (float): Outline thickness, relative to the symbol half-width.
+        stripe_period (int): Distance between stripes in pixels.
+
+    Returns:
+        np.array: Coverage in [0, 1] of shape (3 shapes, 3 shadings, height,
+        width), in card_codec SHAPES and SHADINGS order.
+    """
+    masks = np.zeros((3, 3, height, width), dtype=np.float32)
+    stripes = (np.arange(height * SUPERSAMPLE) // SUPERSAMPLE) % stripe_period == 0
+    for s, shape in enumerate(("diamond", "squiggle", "oval")):
+        field = _shape_fields(shape, height, width)
+        inside = field <= 1
+        outline = inside & (field >= 1 - stroke)
+        striped = outline | (inside & stripes[:, None])
+        for shading, fine in enumerate((inside, striped, outline)):
+            masks[s, shading] = cv2.resize(fine.astype(np.float32), (width, height), interpolation=cv2.INTER_AREA)
+    return masks
+
+
+@lru_cache(maxsize=None)
+def card_masks(height=CARD_HEIGHT, width=CARD_WIDTH):
+    """
+    Compose the symbol coverage of every card, once per card size.
+
+    Returns:
+        np.array: Coverage of shape (81, height, width), by card id. Cards
+        that differ only in colour share their coverage. The array is shared
+        between calls and must not be modified.
+    """
+    symbol_height = int(height * 0.7)
+    symbol_width = int(width * 0.22)
+    symbols = symbol_masks(symbol_height, symbol_width)
+    top = (height - symbol_height) // 2
+    gap = int(width * 0.04)
+
+    # (number, shape, shading) layouts; the colour digit does not change them
+    layouts = np.zeros((3, 3, 3, height, width), dtype=np.float32)
+    for n in range(3):
+        count = n + 1
+        left = (width - count * symbol_width - (count - 1) * gap) // 2
+        for i in range(count):
+            x = left + i * (symbol_width + gap)
+            layouts[n, :, :, top:top + symbol_height, x:x + symbol_width] = symbols
+    digits = np.array(DIGITS)
+    return layouts[digits[:, 0], digits[:, 1], digits[:, 2]]
+
+
+def _compose_planar(coverage, card_ids, background, gain, offset):
+    """compose, as channel-first (N, 3, H, W) images: broadcasting over
+    contiguous rows is several times faster than over the channel axis."""
+    ink = INK[np.array(DIGITS)[card_ids, 3]] * gain + offset
+    background = np.broadcast_to(np.asarray(background, dtype=np.float32) * gain + offset, ink.shape)
+    images = coverage[:, None] * (ink - background)[:, :, None, None].astype(np.float32)
+    images += background[:, :, None, None].astype(np.float32)
+    return images
+
+
+def compose(coverage, card_ids, background=BACKGROUND, gain=1.0, offset=0.0):
+    """
+    Colour coverage masks: each pixel blends the background and the card's ink.
+
+    Args:
+        coverage (np.array): Coverage of shape (N, H, W).
+        card_ids (np.array): Card ids (N,), which give the ink colour.
+        background (np.array): RGB background, (3,) or (N, 3).
+        gain (np.array): Lighting gain of both colours, scalar or (N, 1).
+        offset (np.array): Lighting offset of both colours, scalar or (N, 1).
+
+    Returns:
+        np.array: Float RGB images (N, H, W, 3).
+    """
+    return _compose_planar(coverage, card_ids, background, gain, offset).transpose(0, 2, 3, 1)
+
+
+def render_deck(height=CARD_HEIGHT, width=CARD_WIDTH):
+    """
+    Render all 81 cards.
+
+    Returns:
+        np.array: RGB uint8 images of shape (81, height, width, 3), by card id.
+    """
+    images = compose(card_masks(height, width), np.arange(NUM_CARDS))
+    return np.rint(images).astype(np.uint8, order="C")
+
+
+def random_variants(batch_size=256, height=CARD_HEIGHT, width=CARD_WIDTH, seed=None, max_rotation=10, max_shift=0.05, max_scale=0.1, noise=6.0):
+    """
+    Yield endless batches of randomly varied cards.
+
+    Each card gets a random rotation, shift and scale of its symbols,
+    a background tint, a lighting gain and offset and pixel noise.
+
+    Args:
+        batch_size (int): Cards per batch.
+        height (int): Card height in pixels.
+        width (int): Card width in pixels.
+        seed (int): Seed for the random generator.
+        max_rotation (float): Largest rotation in degrees.
+        max_shift (float): Largest shift, relative to the card size.
+        max_scale (float): Largest relative change of scale.
+        noise (float): Standard deviation of the pixel noise.
+
+    Yields:
+        tuple: RGB uint8 images (batch_size, height, width, 3) and their card
+        ids (batch_size,).
+    """
+    rng = np.random.default_rng(seed)
+    masks = card_masks(height, width)
+    centre = (width / 2, height / 2)
+    # Drawing fresh Gaussian noise for every pixel costs more than the rest
+    # of the rendering; cards pick a field from a bank and a sign instead
+    noise_bank = rng.standard_normal((32, 3, height, width), dtype=np.float32) * noise
+    while True:
+        card_ids = rng.integers(NUM_CARDS, size=batch_size)
+        angles = rng.uniform(-max_rotation, max_rotation, batch_size)
+        scales = 1 + rng.uniform(-max_scale, max_scale, batch_size)
+        shifts = rng.uniform(-max_shift, max_shift, (batch_size, 2)) * (width, height)
+
+        coverage = np.empty((batch_size, height, width), dtype=np.float32)
+        for i, card_id in enumerate(card_ids):
+            matrix = cv2.getRotationMatrix2D(centre, angles[i], scales[i])
+            matrix[:, 2] += shifts[i]
+            coverage[i] = cv2.warpAffine(masks[card_id], matrix, (width, height), flags=cv2.INTER_LINEAR)
+
+        # Background tint and lighting, applied to the two colours of each card
+        background = BACKGROUND - rng.uniform(0, 40, (batch_size, 1)) - rng.uniform(0, 15, (batch_size, 3))
+        gain = rng.uniform(0.6, 1.1, (batch_size, 1))
+        offset = rng.uniform(-20, 20, (batch_size, 1))
+        images = _compose_planar(coverage, card_ids, background, gain, offset)
+
+        # Sensor noise
+        signs = rng.choice(np.array([-1, 1], dtype=np.float32), batch_size)[:, None, None, None]
+        images += noise_bank[rng.integers(len(noise_bank), size=batch_size)] * signs
+        np.clip(images, 0, 255, out=images)
+        yield images.transpose(0, 2, 3, 1).astype(np.uint8, order="C"), card_ids
+
+
+def benchmark_render(batches=20, batch_size=256, seed=0):
+    """Print rendering throughput of render_deck and random_variants."""
+    start = time.perf_counter()
+    render_deck()
+    print(f"render_deck: {(time.perf_counter() - start) * 1e3:.1f} ms for 81 cards")
+
+    variants = random_variants(batch_size, seed=seed)
+    next(variants)
+    start = time.perf_counter()
+    for _ in range(batches):
+        next(variants)
+    rate = batches * batch_size / (time.perf_counter() - start)
+    print(f"random_variants: {rate:,.0f} cards/s")
+    return rate
+
+
+if __name__ == "__main__":
+    benchmark_render()
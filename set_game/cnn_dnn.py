@@ -0,0 +1,299 @@
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from card_codec import SHAPES
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# The notebooks' transform: Resize((64, 64)), ToTensor, Normalize(0.5, 0.5)
+INPUT_SIZE = 64
+MEAN = 0.5
+STD = 0.5
+
+
+def _model_classes():
+    """
+    The SimplestCNN and SimpleCNN models of vision/cnn/cnn-shape.ipynb.
+
+    PyTorch is only needed to export the notebook models, so it is
+    imported here rather than at module level.
+    """
+    import torch.nn as nn
+    import torch.nn.functional as F
+
+    class SimplestCNN(nn.Module):
+        def __init__(self):
+            super(SimplestCNN, self).__init__()
+            self.conv1 = nn.Conv2d(3, 32, kernel_size=3, padding=1)
+            self.conv2 = nn.Conv2d(32, 64, kernel_size=3, padding=1)
+            self.conv3 = nn.Conv2d(64, 128, kernel_size=3, padding=1)
+            self.pool = nn.MaxPool2d(kernel_size=2, stride=2, padding=0)
+
+            self.fc1 = nn.Linear(128 * 8 * 8, 256)
+            self.fc2 = nn.Linear(256, 128)
+            self.fc3 = nn.Linear(128, 3)  # 3 shape classes: diamond, squiggle, oval
+
+        def forward(self, x):
+            x = self.pool(F.relu(self.conv1(x)))
+            x = self.pool(F.relu(self.conv2(x)))
+            x = self.pool(F.relu(self.conv3(x)))
+            x = x.view(-1, 128 * 8 * 8)
+            x = F.relu(self.fc1(x))
+            x = F.relu(self.fc2(x))
+            x = self.fc3(x)
+            return x
+
+    class SimpleCNN(nn.Module):
+        def __init__(self):
+            super(SimpleCNN, self).__init__()
+            self.conv1 = nn.Conv2d(3, 32, kernel_size=3, padding=1)
+            self.conv2 = nn.Conv2d(32, 64, kernel_size=3, padding=1)
+            self.conv3 = nn.Conv2d(64, 128, kernel_size=3, padding=1)
+            self.conv4 = nn.Conv2d(128, 256, kernel_size=3, padding=1)
+            self.pool = nn.MaxPool2d(kernel_size=2, stride=2, padding=0)
+
+            self.fc1 = nn.Linear(256 * 4 * 4, 256)
+            self.fc2 = nn.Linear(256, 128)
+            self.fc3 = nn.Linear(128, 3)  # 3 classes: diamond, squiggle, oval
+
+        def forward(self, x):
+            x = self.pool(F.relu(self.conv1(x)))
+            x = self.pool(F.relu(self.conv2(x)))
+            x = self.pool(F.relu(self.conv3(x)))
+            x = self.pool(F.relu(self.conv4(x)))
+            x = x.view(-1, 256 * 4 * 4)
+            x = F.relu(self.fc1(x))
+            x = F.relu(self.fc2(x))
+            x = self.fc3(x)
+            return x
+
+    return {"SimplestCNN": SimplestCNN, "SimpleCNN": SimpleCNN}
+
+
+def load_notebook_model(path, architecture="SimplestCNN"):
+    """
+    Load a model trained in the notebooks.
+
+    Args:
+        path (str): A .pth file written by the notebooks' save_model (a whole
+            pickled model) or a state dict.
+        architecture (str): "SimplestCNN" or "SimpleCNN", for state dicts and
+            to unpickle whole models.
+
+    Returns:
+        torch.nn.Module: The model, in evaluation mode.
+    """
+    import torch
+
+    classes = _model_classes()
+    # save_model pickles the model with its class defined in the notebook's
+    # __main__, so the class has to be found there to unpickle it
+    main = sys.modules["__main__"]
+    for name, model_class in classes.items():
+        if not hasattr(main, name):
+            setattr(main, name, model_class)
+    checkpoint = torch.load(path, map_location="cpu", weights_only=False)
+    if isinstance(checkpoint, dict):
+        model = classes[architecture]()
+        model.load_state_dict(checkpoint)
+    else:
+        model = checkpoint
+    return model.eval()
+
+
+def export_onnx(model, onnx_path, opset_version=11):
+    """
+    Export a notebook model to ONNX with a variable batch size.
+
+    Args:
+        model (torch.nn.Module): Model taking (N, 3, 64, 64) normalised RGB.
+        onnx_path (str): Output file.
+        opset_version (int): ONNX opset; OpenCV's importer supports 11 well.
+    """
+    import torch
+
+    dummy = torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE)
+    torch.onnx.export(
+        model.eval(), dummy, onnx_path,
+        input_names=["input"], output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset_version,
+    )
+    logger.info(f"Exported {type(model).__name__} to {onnx_path}")
+
+
+def preprocess(images, bgr=False):
+    """
+    Apply the notebooks' transform to a batch of card crops.
+
+    Resizing is per image (area interpolation, like PIL's antialiased
+    resize); scaling, normalisation, channel order and layout are single
+    operations on the whole batch.
+
+    Args:
+        images (np.array): uint8 crops (N, H, W, 3), or a list of crops of
+            different sizes.
+        bgr (bool): Whether the images are in OpenCV's BGR channel order.
+
+    Returns:
+        np.array: float32 blob (N, 3, 64, 64) of normalised RGB.
+    """
+    size = (INPUT_SIZE, INPUT_SIZE)
+    batch = np.array([cv2.resize(image, size, interpolation=cv2.INTER_AREA) for image in images], dtype=np.uint8)
+    if bgr:
+        batch = batch[..., ::-1]
+    blob = batch.transpose(0, 3, 1, 2).astype(np.float32)
+    # (x / 255 - MEAN) / STD in one multiply-add
+    blob *= 1 / (255 * STD)
+    blob -= MEAN / STD
+    return blob
+
+
+def _softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class CNNClassifier:
+    """
+    CPU inference of an exported notebook CNN with OpenCV's DNN module.
+
+    The ONNX file is read once. cv2.dnn.Net is not thread-safe, so every
+    thread that runs inference gets its own network built from those bytes;
+    forward passes release the GIL, so batches on the classifier's thread
+    pool run concurrently. The pool lives as long as the classifier, so each
+    of its threads builds its network once; close it when done.
+    """
+
+    def __init__(self, onnx_path, classes=SHAPES, threads=None):
+        """
+        Args:
+            onnx_path (str): Model exported by export_onnx.
+            classes (list): Class names, indexed by output.
+            threads (int): Size of the thread pool used by predict_many.
+                None runs batches one after another in the calling thread.
+        """
+        with open(onnx_path, "rb") as f:
+            self.model = np.frombuffer(f.read(), dtype=np.uint8)
+        self.classes = list(classes)
+        self.threads = threads
+        self._local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=threads) if threads else None
+        self.net()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Shut down the thread pool."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def net(self):
+        """Return this thread's network, building it on first use."""
+        net = getattr(self._local, "net", None)
+        if net is None:
+            net = cv2.dnn.readNetFromONNX(self.model)
+            net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            self._local.net = net
+        return net
+
+    def predict_proba(self, images, bgr=False):
+        """
+        Return the class probabilities of a batch of card crops.
+
+        Args:
+            images (np.array): uint8 crops (N, H, W, 3), or a list of crops.
+            bgr (bool): Whether the images are in OpenCV's BGR channel order.
+
+        Returns:
+            np.array: Probabilities (N, len(classes)).
+        """
+        if not len(images):
+            return np.empty((0, len(self.classes)), dtype=np.float32)
+        net = self.net()
+        net.setInput(preprocess(images, bgr))
+        return _softmax(net.forward())
+
+    def predict_batch(self, images, bgr=False):
+        """Classify a batch of card crops, returning a list of class names."""
+        return [self.classes[i] for i in self.predict_proba(images, bgr).argmax(axis=1)]
+
+    def predict_many(self, batches, bgr=False):
+        """
+        Return the class probabilities of several batches, concurrently on
+        the thread pool if threads is set.
+        """
+        if self.executor is None:
+            return [self.predict_proba(batch, bgr) for batch in batches]
+        return list(self.executor.map(lambda batch: self.predict_proba(batch, bgr), batches))
+
+
+def benchmark_inference(onnx_path, model=None, batch_sizes=(1, 16, 64), repeats=20, threads=None, seed=0):
+    """
+    Print the latency and throughput of CNNClassifier and, if a PyTorch model
+    is given, of the notebook model on the same inputs with their largest
+    difference in probability.
+
+    Args:
+        onnx_path (str): Exported model.
+        model (torch.nn.Module): The notebook model it was exported from.
+        batch_sizes (tuple): Batch sizes to time.
+        repeats (int): Timed runs per batch size.
+        threads (int): Also time predict_many on a pool of this many threads.
+        seed (int): Seed for the random crops.
+    """
+    rng = np.random.default_rng(seed)
+    classifier = CNNClassifier(onnx_path, threads=threads)
+    for batch_size in batch_sizes:
+        images = rng.integers(0, 256, (batch_size, 96, 150, 3), dtype=np.uint8)
+        probabilities = classifier.predict_proba(images)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            classifier.predict_proba(images)
+        elapsed = (time.perf_counter() - start) / repeats
+        line = f"cv2.dnn batch {batch_size}: {elapsed * 1e3:.1f} ms, {batch_size / elapsed:,.0f} cards/s"
+
+        if model is not None:
+            import torch
+
+            with torch.no_grad():
+                blob = torch.from_numpy(preprocess(images))
+                reference = torch.softmax(model(blob), dim=1).numpy()
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    model(blob)
+                torch_elapsed = (time.perf_counter() - start) / repeats
+            line += f"; PyTorch: {torch_elapsed * 1e3:.1f} ms, largest difference {np.abs(probabilities - reference).max():.1e}"
+        print(line)
+
+    if threads:
+        batches = [rng.integers(0, 256, (16, 96, 150, 3), dtype=np.uint8) for _ in range(threads * 4)]
+        classifier.predict_many(batches)
+        start = time.perf_counter()
+        classifier.predict_many(batches)
+        elapsed = time.perf_counter() - start
+        print(f"predict_many on {threads} threads: {len(batches) * 16 / elapsed:,.0f} cards/s")
+    classifier.close()
+
+
+if __name__ == "__main__":
+    # Export a checkpoint saved by the notebooks, then compare both runtimes
+    checkpoint, architecture = sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "SimplestCNN"
+    onnx_path = checkpoint.rsplit(".", 1)[0] + ".onnx"
+    notebook_model = load_notebook_model(checkpoint, architecture)
+    export_onnx(notebook_model, onnx_path)
+    benchmark_inference(onnx_path, notebook_model, threads=4)
@@ -0,0 +1,141 @@
+import logging
+import os
+import time
+
+import numpy as np
+
+from card_codec import feature, parse_filename
+from colour_softmax import COLOR_NAMES, load_image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Card colours in card_codec.COLORS order, as named by colour_softmax
+CARD_COLORS = {"red": 0, "green": 1, "purple": 2}
+
+
+class ColourLUT:
+    """
+    Colour classifier built on a quantized RGB cube.
+
+    Every cell of the cube holds the probability of each card colour given a
+    pixel in that cell, or is marked as background. Classifying an image is
+    one table gather over its pixels and a histogram of the foreground cells;
+    the colour probabilities are the average over foreground pixels.
+    """
+
+    def __init__(self, posterior, foreground, bits=5):
+        """
+        Args:
+            posterior (np.array): Colour probabilities per cell, shape (cells, 3).
+            foreground (np.array): Whether each cell is card ink, shape (cells,).
+            bits (int): Bits kept per channel; the cube has 2**(3 * bits) cells.
+        """
+        self.posterior = np.asarray(posterior, dtype=np.float32)
+        self.foreground = np.asarray(foreground, dtype=bool)
+        self.bits = bits
+
+    @staticmethod
+    def cell_indices(image, bits=5):
+        """
+        Return the cube cell of every pixel of a BGR uint8 image, flattened.
+        """
+        shift = 8 - bits
+        pixels = image.reshape(-1, 3) >> shift
+        index = pixels[:, 0].astype(np.int32) << (2 * bits)
+        index |= pixels[:, 1].astype(np.int32) << bits
+        index |= pixels[:, 2]
+        return index
+
+    @classmethod
+    def fit(cls, directory_path, bits=5, reduction=4, min_chroma=40, min_purity=0.8, min_count=20):
+        """
+        Fit the table from images labelled by their file names.
+
+        Each image contributes its cell histogram to the histogram of its
+        card colour. Histograms are normalized per colour so that colours
+        with more ink do not dominate, and smoothed by one count. Cells close
+        to grey, seen too rarely, or shared between colours (card face,
+        table, shadows) are background.
+
+        Args:
+            directory_path (str): Directory of images named by card code.
+            bits (int): Bits kept per channel.
+            reduction (int): Decode images at 1/reduction of their size.
+            min_chroma (int): Smallest channel spread of a foreground cell centre.
+            min_purity (float): Smallest top colour probability of a foreground cell.
+            min_count (int): Fewest pixels seen in a foreground cell.
+
+        Returns:
+            ColourLUT: The fitted classifier.
+        """
+        cells = 1 << (3 * bits)
+        counts = np.zeros((len(CARD_COLORS), cells), dtype=np.float64)
+        for filename in sorted(os.listdir(directory_path)):
+            card_id = parse_filename(filename)
+            if card_id is None:
+                continue
+            image = load_image(os.path.join(directory_path, filename), reduction)
+            colour = CARD_COLORS[feature(card_id, "color")]
+            counts[colour] += np.bincount(cls.cell_indices(image, bits), minlength=cells)
+
+        likelihood = (counts + 1) / (counts + 1).sum(axis=1, keepdims=True)
+        posterior = likelihood / likelihood.sum(axis=0)
+
+        # Channel spread of each cell centre
+        centres = (np.arange(1 << bits) << (8 - bits)) + (1 << (7 - bits))
+        b, g, r = np.meshgrid(centres, centres, centres, indexing="ij")
+        chroma = (np.maximum(np.maximum(b, g), r) - np.minimum(np.minimum(b, g), r)).ravel()
+
+        foreground = (chroma >= min_chroma) & (posterior.max(axis=0) >= min_purity) & (counts.sum(axis=0) >= min_count)
+        logger.info(f"Fitted colour table: {foreground.sum()} of {cells} cells are foreground")
+        return cls(posterior.T, foreground, bits)
+
+    def predict(self, image):
+        """
+        Classify a BGR image.
+
+        Args:
+            image (np.array): BGR uint8 image, as decoded by OpenCV.
+
+        Returns:
+            tuple: Dominant color name (Red, Green, Blue) and dictionary of
+            color probabilities.
+        """
+        index = self.cell_indices(image, self.bits)
+        index = index[self.foreground[index]]
+        if not len(index):
+            raise ValueError("Image has no foreground pixels.")
+        hist = np.bincount(index, minlength=len(self.foreground))
+        probabilities = hist @ self.posterior / len(index)
+        return COLOR_NAMES[np.argmax(probabilities)], dict(zip(COLOR_NAMES, probabilities.tolist()))
+
+    def predict_batch(self, images):
+        """Classify a batch of BGR images, returning a list of predict results."""
+        return [self.predict(image) for image in images]
+
+    def predict_path(self, image_path, reduction=4, cache=None):
+        """Classify an image decoded at 1/reduction of its size, or read from an ImageCache."""
+        return self.predict(load_image(image_path, reduction, cache))
+
+    def save(self, path):
+        """Save the table as a NumPy .npz file."""
+        np.savez_compressed(path, posterior=self.posterior, foreground=self.foreground, bits=self.bits)
+
+    @classmethod
+    def load(cls, path):
+        """Load a table saved by save."""
+        with np.load(path) as data:
+            return cls(data["posterior"], data["foreground"], int(data["bits"]))
+
+
+if __name__ == "__main__":
+    from colour_softmax import evaluate_directory
+
+    lut = ColourLUT.fit("./data/original")
+    lut.save("./colour_lut.npz")
+
+    start = time.perf_counter()
+    incorrect_files = evaluate_directory("./data/original_compressed", log_files=False, classifier=lut, reduction=4)
+    logger.info(f"Classified in {time.perf_counter() - start:.2f} s; incorrect: {incorrect_files}")
@@ -3,13 +3,20 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from termcolor import colored
 from skimage import exposure
 
+from card_codec import feature, parse_filename
+from image_cache import decode_image, init_worker_cache, worker_cache
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+COLOR_NAMES = ['Red', 'Green', 'Blue']
+
 def softmax(x):
     """
     Compute the softmax of vector x in a numerically stable way.
@@ -79,12 +86,13 @@ def check_and_adjust_brightness(image, threshold=100, increment=50):
         image = increase_brightness(image, increment)
     return image
 
-def guess_dominant_color(image):
+def guess_dominant_color(image, dark_threshold=50):
     """
     Guess the dominant color of an image based on heuristic rules.
     
     Args:
         image (np.array): Input RGB image.
+        dark_threshold (int): Brightness below which Blue is guessed.
         
     Returns:
         str: Guessed dominant color.
@@ -93,7 +101,7 @@ def guess_dominant_color(image):
     brightness = np.mean(hsv[:, :, 2])
     logger.info(f"Brightness: {brightness}")
     
-    if brightness < 50:
+    if brightness < dark_threshold:
         return 'Blue'
     
     return None
@@ -119,24 +127,128 @@ def plot_color_channels(image, title):
     plt.suptitle(title)
     plt.show()
 
-def get_dominant_color(image_path):
+def load_image(image_path, reduction=1, cache=None):
+    """
+    Decode an image once, optionally at reduced resolution.
+    
+    Args:
+        image_path (str): Path to the image file.
+        reduction (int): Scale divisor (1, 2, 4 or 8). JPEGs are decoded
+            directly at the reduced size.
+        cache (ImageCache): Read the decoded image from this cache instead;
+            its own reduction applies.
+        
+    Returns:
+        np.array: BGR image, as decoded by OpenCV.
+    """
+    if cache is not None:
+        return cache.get(image_path)
+    return decode_image(image_path, reduction)
+
+def extract_color_features(image, threshold=100, increment=50, bgr=False):
+    """
+    Compute the brightness and channel sums of get_dominant_color in one
+    fused pass, without the HSV and YUV round trips.
+    
+    The HSV brightness is the channel maximum. Raising it by increment
+    scales all channels of a pixel by the same factor, and equalizing the
+    YUV luma shifts all channels of a pixel by the same amount, so both are
+    applied directly to the RGB values; the equalization becomes two
+    saturating uint8 additions of per-luma lookup tables.
+    
+    Args:
+        image (np.array): RGB (or BGR) image, uint8.
+        threshold (int): Brightness below which the image is brightened.
+        increment (int): Brightness increase for a dark image.
+        bgr (bool): Whether the image is in OpenCV's BGR channel order.
+        
+    Returns:
+        tuple: Brightness before adjustment, brightness after adjustment and
+        equalization, and the (Red, Green, Blue) channel sums.
+    """
+    channels = cv2.split(image)
+    value = cv2.max(cv2.max(channels[0], channels[1]), channels[2])
+    brightness = cv2.mean(value)[0]
+
+    if brightness < threshold:
+        value_f = value.astype(np.float32)
+        scale = cv2.min(value_f + increment, 255) / cv2.max(value_f, 1)
+        channels = [cv2.multiply(channel, scale, dtype=cv2.CV_8U) for channel in channels]
+        # Black pixels have no hue and become grey
+        black = value == 0
+        for channel in channels:
+            channel[black] = increment
+        value = cv2.max(cv2.max(channels[0], channels[1]), channels[2])
+        image = cv2.merge(channels)
+
+    # Equalize the luma histogram as cv2.equalizeHist does, as a per-luma shift
+    luma = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY if bgr else cv2.COLOR_RGB2GRAY)
+    hist = np.bincount(luma.ravel(), minlength=256)
+    cdf = hist.cumsum()
+    cdf_min = cdf[np.flatnonzero(hist)[0]]
+    lut = np.rint((cdf - cdf_min) * 255.0 / max(cdf[-1] - cdf_min, 1))
+    shift = lut - np.arange(256)
+    raise_by = cv2.LUT(luma, np.clip(shift, 0, 255).astype(np.uint8))
+    lower_by = cv2.LUT(luma, np.clip(-shift, 0, 255).astype(np.uint8))
+
+    sums = [cv2.sumElems(cv2.subtract(cv2.add(channel, raise_by), lower_by))[0] for channel in channels]
+    adjusted_brightness = cv2.mean(cv2.subtract(cv2.add(value, raise_by), lower_by))[0]
+    if bgr:
+        sums.reverse()
+    return brightness, adjusted_brightness, np.array(sums)
+
+def get_dominant_colors(images, threshold=100, increment=50, dark_threshold=50, bgr=False):
+    """
+    Determine the dominant color (Red, Green, Blue) of a batch of images with
+    the fused feature path.
+    
+    Args:
+        images (np.array): RGB images of shape (N, H, W, 3), or a list of
+            images of different sizes.
+        threshold (int): Brightness below which an image is brightened.
+        increment (int): Brightness increase for dark images.
+        dark_threshold (int): Adjusted brightness below which Blue is guessed.
+        bgr (bool): Whether the images are in OpenCV's BGR channel order.
+        
+    Returns:
+        list: Dominant color name and dictionary of color confidences per image.
+    """
+    results = []
+    for image in images:
+        _, adjusted_brightness, sums = extract_color_features(image, threshold, increment, bgr)
+        # Heuristic rule: if the image is very dark, guess blue
+        if adjusted_brightness < dark_threshold:
+            results.append(('Blue', {'Red': 0.0, 'Green': 0.0, 'Blue': 1.0}))
+            continue
+        confidences = softmax(sums)
+        results.append((COLOR_NAMES[np.argmax(confidences)], dict(zip(COLOR_NAMES, confidences))))
+    return results
+
+def get_dominant_color(image_path, fused=False, reduction=1, threshold=100, increment=50, dark_threshold=50, cache=None):
     """
     Determine the dominant color (Red, Green, Blue) in the given image.
     
     Args:
         image_path (str): Path to the image file.
+        fused (bool): Use the single-pass feature path of get_dominant_colors.
+        reduction (int): Decode at 1/reduction of the size (fused path only).
+        threshold (int): Brightness below which the image is brightened.
+        increment (int): Brightness increase for a dark image.
+        dark_threshold (int): Adjusted brightness below which Blue is guessed.
+        cache (ImageCache): Read the decoded image from this cache.
         
     Returns:
         tuple: Dominant color name and dictionary of color confidences.
     """
-    image = cv2.imread(image_path)
-    if image is None:
-        raise ValueError(f"Image at path {image_path} could not be loaded.")
+    if fused:
+        return get_dominant_colors([load_image(image_path, reduction, cache)], threshold, increment, dark_threshold, bgr=True)[0]
+
+    image = load_image(image_path, cache=cache)
     
     image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     
     # Check and adjust brightness if necessary
-    image = check_and_adjust_brightness(image)
+    image = check_and_adjust_brightness(image, threshold, increment)
     
     # Normalize brightness
     image = normalize_brightness(image)
@@ -152,7 +264,7 @@ def get_dominant_color(image_path):
     logger.info(f"Red Sum: {red_sum}, Green Sum: {green_sum}, Blue Sum: {blue_sum}")
     
     # Heuristic rule: if the image is very dark, guess blue
-    dominant_color = guess_dominant_color(image)
+    dominant_color = guess_dominant_color(image, dark_threshold)
     if dominant_color:
         return dominant_color, {'Red': 0.0, 'Green': 0.0, 'Blue': 1.0}
     
@@ -160,11 +272,10 @@ def get_dominant_color(image_path):
     confidences = softmax([red_sum, green_sum, blue_sum])
     
     # Map results to colors
-    color_names = ['Red', 'Green', 'Blue']
-    color_confidences = dict(zip(color_names, confidences))
+    color_confidences = dict(zip(COLOR_NAMES, confidences))
     
     # Find the dominant color
-    dominant_color = color_names[np.argmax(confidences)]
+    dominant_color = COLOR_NAMES[np.argmax(confidences)]
     
     return dominant_color, color_confidences
 
@@ -182,54 +293,132 @@ def display_image_with_text(image, text):
     plt.axis('off')
     plt.show()
 
-def evaluate_directory(directory_path):
+def _init_worker(log_level, cache_config=None):
+    """Set the log level of a worker process and open its image cache."""
+    logger.setLevel(log_level)
+    init_worker_cache(cache_config)
+
+
+def classify_file(task, fused=False, reduction=1, classifier=None, cache=None):
+    """
+    Classify one image file for evaluate_directory.
+
+    Args:
+        task (tuple): File name, image path and expected color.
+        fused (bool): Use the fused feature path.
+        reduction (int): Decode at 1/reduction of the size (fused path or
+            classifier only).
+        classifier (ColourLUT): Classify with this lookup table instead.
+        cache (ImageCache): Read decoded images from this cache. Defaults
+            to the cache of the worker process, if any.
+
+    Returns:
+        tuple: File name, expected color, detected color (None if the image
+        could not be loaded) and confidences as a (Red, Green, Blue) tuple or
+        the error message.
+    """
+    filename, image_path, expected_color = task
+    if cache is None:
+        cache = worker_cache()
+    try:
+        if classifier is not None:
+            dominant_color, confidences = classifier.predict_path(image_path, reduction, cache)
+        else:
+            dominant_color, confidences = get_dominant_color(image_path, fused, reduction, cache=cache)
+    except ValueError as e:
+        return filename, expected_color, None, str(e)
+    return filename, expected_color, dominant_color, tuple(float(confidences[color]) for color in COLOR_NAMES)
+
+
+def evaluate_directory(directory_path, workers=None, chunksize=8, log_files=True, fused=False, reduction=1, classifier=None, cache=None, catalog=None):
     """
     Evaluate all images in the specified directory, checking the dominant color
     against the expected color indicated by the file name.
     
     Args:
         directory_path (str): Path to the directory containing image files.
+        workers (int): Number of worker processes. None or 1 classifies the
+            images in this process.
+        chunksize (int): Number of images sent to a worker per task.
+        log_files (bool): Whether to log the result of every image.
+        fused (bool): Use the fused single-pass feature path.
+        reduction (int): Decode at 1/reduction of the size (fused path or
+            classifier only).
+        classifier (ColourLUT): Classify with a fitted colour lookup table
+            (see colour_lut) instead of the softmax of channel sums.
+        cache (ImageCache): Read decoded images from this cache, decoding
+            missing ones across worker processes first.
+        catalog (Catalog): Take the card images of the directory and their
+            colours from this corpus catalog instead of listing and parsing
+            the file names. Files added or changed since its last update
+            are not seen.
         
     Returns:
         list: List of incorrectly classified file names.
     """
-    color_map = {'R': 'Red', 'G': 'Green', 'P': 'Blue'}
+    color_map = {'red': 'Red', 'green': 'Green', 'purple': 'Blue'}
     correct_count = 0
     incorrect_count = 0
     incorrect_files = []
     total_confidences = {'Red': [], 'Green': [], 'Blue': []}
     
-    for filename in os.listdir(directory_path):
-        if not filename.endswith(('.jpg', '.png')):
-            logger.info(f"Skipping non-image file: {filename}")
-            continue
-        
-        expected_color_code = filename[1]
-        if expected_color_code not in color_map:
-            logger.info(f"Skipping file with unexpected color code: {filename}")
+    tasks = []
+    if catalog is not None:
+        for row in catalog.rows(directory=directory_path):
+            if row["color"] is not None:
+                tasks.append((os.path.basename(row["path"]), row["path"], color_map[row["color"]]))
+    else:
+        for filename in os.listdir(directory_path):
+            if not filename.endswith(('.jpg', '.png')):
+                logger.info(f"Skipping non-image file: {filename}")
+                continue
+
+            card_id = parse_filename(filename)
+            if card_id is None:
+                logger.info(f"Skipping file with unexpected color code: {filename}")
+                continue
+
+            expected_color = color_map[feature(card_id, "color")]
+            tasks.append((filename, os.path.join(directory_path, filename), expected_color))
+
+    if cache is not None:
+        cache.warm([image_path for _, image_path, _ in tasks], workers)
+
+    classify = partial(classify_file, fused=fused, reduction=reduction, classifier=classifier)
+    log_level = logger.level if log_files else logging.WARNING
+    if workers is None or workers <= 1:
+        previous_level = logger.level
+        logger.setLevel(log_level)
+        try:
+            results = [classify(task, cache=cache) for task in tasks]
+        finally:
+            logger.setLevel(previous_level)
+    else:
+        # Workers open the cache once from its settings rather than receive it with every chunk
+        cache_config = cache.config() if cache is not None else None
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(log_level, cache_config)) as executor:
+            results = list(executor.map(classify, tasks, chunksize=chunksize))
+
+    for filename, expected_color, dominant_color, confidences in results:
+        if dominant_color is None:
+            logger.error(confidences)
             continue
+
+        for color, confidence in zip(COLOR_NAMES, confidences):
+            total_confidences[color].append(confidence)
         
-        expected_color = color_map[expected_color_code]
-        image_path = os.path.join(directory_path, filename)
+        if dominant_color == expected_color:
+            correct_count += 1
+            log_color = 'green'
+        else:
+            incorrect_count += 1
+            incorrect_files.append(filename)
+            log_color = 'red'
         
-        try:
-            dominant_color, confidences = get_dominant_color(image_path)
-            
-            for color, confidence in confidences.items():
-                total_confidences[color].append(confidence)
-            
-            if dominant_color == expected_color:
-                correct_count += 1
-                log_color = 'green'
-            else:
-                incorrect_count += 1
-                incorrect_files.append(filename)
-                log_color = 'red'
-            
+        if log_files:
+            confidences = dict(zip(COLOR_NAMES, confidences))
             log_text = f"File: {filename}, Expected: {expected_color}, Detected: {dominant_color}, Confidences: {confidences}"
             logger.info(colored(log_text, log_color))
-        except ValueError as e:
-            logger.error(e)
     
     total_files = correct_count + incorrect_count
     accuracy = correct_count / total_files if total_files > 0 else 0
@@ -251,5 +440,5 @@ def evaluate_directory(directory_path):
 
 if __name__ == "__main__":
     directory_path = "./data/original"
-    incorrect_files = evaluate_directory(directory_path)
+    incorrect_files = evaluate_directory(directory_path, workers=os.cpu_count())
     logger.info(f"\nIncorrectly Classified Files: {incorrect_files}")
\ No newline at end of file
@@ -0,0 +1,183 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from card_codec import feature, parse_filename
+from colour_softmax import COLOR_NAMES, extract_color_features, load_image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COLOR_INDEX = {"red": 0, "green": 1, "purple": 2}
+BLUE = COLOR_NAMES.index("Blue")
+
+THRESHOLDS = np.arange(0, 256, 5)
+INCREMENTS = np.arange(0, 155, 5)
+DARK_THRESHOLDS = np.arange(0, 256, 5)
+
+
+def image_statistics(image_path, increments=INCREMENTS, reduction=4):
+    """
+    Decode one image and compute everything the colour heuristic depends on.
+
+    Whether an image is brightened only depends on its brightness, so the
+    features are computed once without brightening and once per increment.
+
+    Args:
+        image_path (str): Path to the image file.
+        increments (np.array): Candidate brightness increments.
+        reduction (int): Decode at 1/reduction of the size.
+
+    Returns:
+        tuple: Brightness, adjusted brightness and channel sums without
+        brightening, and adjusted brightness (len(increments),) and channel
+        sums (len(increments), 3) for each increment.
+    """
+    image = load_image(image_path, reduction)
+    brightness, plain_brightness, plain_sums = extract_color_features(image, threshold=0, bgr=True)
+    brightened = [extract_color_features(image, threshold=256, increment=int(increment), bgr=True) for increment in increments]
+    return (
+        brightness,
+        plain_brightness,
+        plain_sums,
+        np.array([features[1] for features in brightened]),
+        np.array([features[2] for features in brightened]),
+    )
+
+
+def extract_statistics(directory_path, increments=INCREMENTS, reduction=4, workers=None):
+    """
+    Compute the statistics of every labelled image in a directory once.
+
+    Args:
+        directory_path (str): Directory of images named by card code.
+        increments (np.array): Candidate brightness increments.
+        reduction (int): Decode at 1/reduction of the size.
+        workers (int): Number of worker processes. Defaults to the CPU count.
+
+    Returns:
+        dict: Arrays over images: file names, expected colour index,
+        brightness, plain_brightness, plain_sums, brightened_brightness and
+        brightened_sums, plus the increments.
+    """
+    filenames = []
+    labels = []
+    for filename in sorted(os.listdir(directory_path)):
+        card_id = parse_filename(filename)
+        if card_id is None or not filename.endswith((".jpg", ".png")):
+            continue
+        filenames.append(filename)
+        labels.append(COLOR_INDEX[feature(card_id, "color")])
+
+    paths = [os.path.join(directory_path, filename) for filename in filenames]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        results = list(executor.map(image_statistics, paths, [increments] * len(paths), [reduction] * len(paths)))
+
+    names = ("brightness", "plain_brightness", "plain_sums", "brightened_brightness", "brightened_sums")
+    stats = {name: np.array(values) for name, values in zip(names, zip(*results))}
+    stats.update(filenames=np.array(filenames), labels=np.array(labels), increments=np.asarray(increments))
+    return stats
+
+
+def score_grid(stats, thresholds=THRESHOLDS, dark_thresholds=DARK_THRESHOLDS, chunk_size=256):
+    """
+    Score every (threshold, increment, dark threshold) combination.
+
+    An image is classified as dark for every dark threshold above its
+    adjusted brightness, so each image adds its result to the counts of one
+    contiguous run of dark thresholds. The counts are accumulated as a
+    difference array over chunks of images, and memory does not grow with
+    the number of images or of dark thresholds.
+
+    Args:
+        stats (dict): Statistics from extract_statistics.
+        thresholds (np.array): Candidate brightness thresholds.
+        dark_thresholds (np.array): Candidate dark-image cutoffs.
+        chunk_size (int): Images scored at a time.
+
+    Returns:
+        np.array: Accuracy of shape (len(thresholds), len(increments),
+        len(dark_thresholds)).
+    """
+    thresholds = np.asarray(thresholds)
+    dark_thresholds = np.asarray(dark_thresholds)
+    num_increments = len(stats["increments"])
+    shape = (len(thresholds), num_increments, len(dark_thresholds) + 1)
+    # Offsets of the (threshold, increment) rows in the flattened counts
+    rows = (np.arange(len(thresholds))[:, None, None] * num_increments + np.arange(num_increments)) * shape[2]
+    counts = np.zeros(np.prod(shape))
+
+    for start in range(0, len(stats["labels"]), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        labels = stats["labels"][chunk]
+        brightened_correct = stats["brightened_sums"][chunk].argmax(axis=2) == labels[:, None]
+        plain_correct = stats["plain_sums"][chunk].argmax(axis=1) == labels
+        brightened = stats["brightness"][chunk][None, :, None] < thresholds[:, None, None]
+
+        # (thresholds, images, increments)
+        correct = np.where(brightened, brightened_correct, plain_correct[:, None])
+        adjusted = np.where(brightened, stats["brightened_brightness"][chunk], stats["plain_brightness"][chunk][:, None])
+        # Dark (and so Blue) from the first dark threshold above the adjusted brightness
+        first_dark = np.searchsorted(dark_thresholds, adjusted, side="right")
+        change = (labels == BLUE)[None, :, None].astype(np.int64) - correct
+
+        counts[rows[:, 0, :].ravel()] += correct.sum(axis=1).ravel()
+        counts += np.bincount((rows + first_dark).ravel(), weights=change.ravel(), minlength=counts.size)
+
+    accuracy = np.cumsum(counts.reshape(shape), axis=2)[..., :-1]
+    return accuracy / len(stats["labels"])
+
+
+def best_settings(accuracy, stats, thresholds=THRESHOLDS, dark_thresholds=DARK_THRESHOLDS, top=5):
+    """
+    Return the most accurate settings, as (accuracy, threshold, increment,
+    dark threshold) tuples.
+    """
+    order = np.argsort(-accuracy, axis=None, kind="stable")[:top]
+    settings = []
+    for t, i, d in zip(*np.unravel_index(order, accuracy.shape)):
+        settings.append((float(accuracy[t, i, d]), int(thresholds[t]), int(stats["increments"][i]), int(dark_thresholds[d])))
+    return settings
+
+
+def tune(directory_path, output_path=None, reduction=4, workers=None):
+    """
+    Extract the image statistics once, score the full parameter grid and
+    log the best settings.
+
+    Args:
+        directory_path (str): Directory of images named by card code.
+        output_path (str): Optional .npz path for the statistics and the
+            accuracy surface.
+        reduction (int): Decode at 1/reduction of the size.
+        workers (int): Number of worker processes. Defaults to the CPU count.
+
+    Returns:
+        list: The best settings, as returned by best_settings.
+    """
+    start = time.perf_counter()
+    stats = extract_statistics(directory_path, reduction=reduction, workers=workers)
+    logger.info(f"Extracted statistics of {len(stats['labels'])} images in {time.perf_counter() - start:.1f} s")
+
+    start = time.perf_counter()
+    accuracy = score_grid(stats)
+    logger.info(f"Scored {accuracy.size} settings in {time.perf_counter() - start:.2f} s")
+
+    default = accuracy[np.searchsorted(THRESHOLDS, 100), np.searchsorted(stats["increments"], 50), np.searchsorted(DARK_THRESHOLDS, 50)]
+    logger.info(f"Current settings (100, 50, 50): accuracy {default:.4f}")
+    settings = best_settings(accuracy, stats)
+    for score, threshold, increment, dark_threshold in settings:
+        logger.info(f"threshold={threshold}, increment={increment}, dark_threshold={dark_threshold}: accuracy {score:.4f}")
+
+    if output_path:
+        np.savez_compressed(output_path, accuracy=accuracy, thresholds=THRESHOLDS, dark_thresholds=DARK_THRESHOLDS, **stats)
+        logger.info(f"Accuracy surface saved at {output_path}")
+    return settings
+
+
+if __name__ == "__main__":
+    tune("./data/original", output_path="./colour_tuning.npz")
@@ -0,0 +1,255 @@
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from card_codec import FEATURE_VALUES, FEATURES, parse_filename
+from image_cache import file_hash
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CATALOG_NAME = ".catalog.sqlite"
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+SPLIT_NAMES = ("train", "valid", "test")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    card_id INTEGER,
+    number INTEGER,
+    shape TEXT,
+    shading TEXT,
+    color TEXT,
+    dataset TEXT,
+    split TEXT,
+    class TEXT,
+    source TEXT,
+    width INTEGER,
+    height INTEGER,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_directory ON images (directory);
+CREATE INDEX IF NOT EXISTS images_split ON images (dataset, split, class);
+CREATE INDEX IF NOT EXISTS images_card ON images (card_id);
+CREATE INDEX IF NOT EXISTS images_source ON images (source);
+"""
+
+COLUMNS = ("path", "directory", "card_id", "number", "shape", "shading", "color", "dataset", "split", "class", "source", "width", "height", "size", "mtime_ns", "hash")
+
+# Columns query filters may use; "class" is a keyword in Python, so it is class_name there
+FILTERS = {"directory", "card_id", "number", "shape", "shading", "color", "dataset", "split", "class_name", "source", "hash"}
+
+
+def parse_path(relative_path):
+    """
+    Return the catalog columns that follow from an image's path alone.
+
+    Card attributes come from the card code at the start of the file name,
+    the dataset, split and class from a dataset_*/<split>/<class>/ layout as
+    written by data_aug, and the source from the name up to the first "_"
+    (data_aug names its output after the source, e.g. 1RES_003.jpg).
+
+    Args:
+        relative_path (str): Path relative to the catalog root.
+
+    Returns:
+        dict: directory, card_id, number, shape, shading, color, dataset,
+        split, class and source.
+    """
+    directory, file_name = os.path.split(relative_path)
+    parts = directory.split(os.sep) if directory else []
+    card_id = parse_filename(file_name)
+    number, shape, shading, color = FEATURES[card_id] if card_id is not None else (None,) * 4
+
+    dataset = next((part for part in parts if part.startswith("dataset_")), None)
+    split = next((part for part in reversed(parts) if part in SPLIT_NAMES), None)
+    class_name = parts[-1] if split and len(parts) >= 2 and parts[-2] == split else None
+    source = os.path.splitext(file_name)[0].split("_")[0] if card_id is not None else None
+    return {
+        "directory": directory, "card_id": card_id, "number": number, "shape": shape, "shading": shading, "color": color,
+        "dataset": dataset, "split": split, "class": class_name, "source": source,
+    }
+
+
+def _describe(path):
+    """Read the size and content hash of one image. Runs in a worker process for update."""
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+    except OSError:
+        width = height = None
+    return width, height, file_hash(path)
+
+
+def _scan(root):
+    """Yield (relative path, stat) of every image under root, skipping hidden directories."""
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(IMAGE_EXTENSIONS):
+                    yield os.path.relpath(entry.path, root), entry.stat()
+
+
+class Catalog:
+    """
+    Index of the image corpus in an sqlite file, so that tools get filtered
+    file lists from a query instead of walking directories and parsing
+    names again.
+
+    Every image under the root has a row with its path, card attributes,
+    dataset, split, class, source image, pixel size, file size, mtime and
+    content hash. update walks the tree once and only reads the files that
+    are new or whose mtime or size changed.
+    """
+
+    def __init__(self, root=".", db_path=None):
+        """
+        Args:
+            root (str): Root directory of the corpus; paths are stored relative to it.
+            db_path (str): Catalog file. Defaults to CATALOG_NAME in root.
+        """
+        self.root = os.path.abspath(root)
+        self.db_path = db_path or os.path.join(self.root, CATALOG_NAME)
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, workers=None, chunksize=64):
+        """
+        Bring the catalog up to date with the files under the root.
+
+        Args:
+            workers (int): Number of worker processes to hash new and changed
+                files. None or 1 hashes them in this process.
+            chunksize (int): Number of files sent to a worker per task.
+
+        Returns:
+            dict: Numbers of files added, updated, removed and unchanged.
+        """
+        known = {row["path"]: (row["mtime_ns"], row["size"]) for row in self.connection.execute("SELECT path, mtime_ns, size FROM images")}
+        changed = []
+        seen = set()
+        for relative_path, stat in _scan(self.root):
+            seen.add(relative_path)
+            if known.get(relative_path) != (stat.st_mtime_ns, stat.st_size):
+                changed.append((relative_path, stat))
+        removed = [path for path in known if path not in seen]
+
+        paths = [os.path.join(self.root, relative_path) for relative_path, _ in changed]
+        if workers is None or workers <= 1:
+            descriptions = [_describe(path) for path in paths]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                descriptions = list(executor.map(_describe, paths, chunksize=chunksize))
+
+        rows = []
+        for (relative_path, stat), (width, height, digest) in zip(changed, descriptions):
+            row = parse_path(relative_path)
+            row.update(path=relative_path, width=width, height=height, size=stat.st_size, mtime_ns=stat.st_mtime_ns, hash=digest)
+            rows.append(tuple(row[column] for column in COLUMNS))
+        with self.connection:
+            self.connection.executemany(f"INSERT OR REPLACE INTO images ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+            self.connection.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in removed])
+
+        added = sum(relative_path not in known for relative_path, _ in changed)
+        counts = {"added": added, "updated": len(changed) - added, "removed": len(removed), "unchanged": len(seen) - len(changed)}
+        logger.info(f"Catalog {self.db_path}: {counts}")
+        return counts
+
+    def _relative_directory(self, directory):
+        relative = os.path.relpath(os.path.abspath(directory), self.root)
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            raise ValueError(f"Directory {directory} is outside the catalog root {self.root}")
+        return "" if relative == "." else relative
+
+    def rows(self, **filters):
+        """
+        Return the catalog rows matching all filters, ordered by path.
+
+        Args:
+            **filters: Column values, such as split="train" or shape="oval";
+                a list or tuple matches any of its values. directory is a
+                path (absolute or relative to the working directory) and
+                matches the images directly in it; class_name filters the
+                class column.
+
+        Rows reflect the files as of the last update.
+
+        Returns:
+            list: Rows as dicts, with path made absolute.
+
+        Raises:
+            ValueError: For an unknown filter or a directory outside the root.
+        """
+        unknown = set(filters) - FILTERS
+        if unknown:
+            raise ValueError(f"Unknown catalog filters: {sorted(unknown)}")
+        clauses = []
+        values = []
+        for name, value in filters.items():
+            if value is None:
+                continue
+            column = "class" if name == "class_name" else name
+            if name == "directory":
+                value = self._relative_directory(value)
+            if isinstance(value, (list, tuple, set)):
+                clauses.append(f"{column} IN ({', '.join('?' * len(value))})")
+                values.extend(value)
+            else:
+                clauses.append(f"{column} = ?")
+                values.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.connection.execute(f"SELECT * FROM images{where} ORDER BY path", values).fetchall()
+        return [dict(row, path=os.path.join(self.root, row["path"])) for row in rows]
+
+    def paths(self, **filters):
+        """Return the absolute paths of the images matching all filters (see rows)."""
+        return [row["path"] for row in self.rows(**filters)]
+
+    def labelled(self, label_feature="shape", **filters):
+        """
+        Return paths and labels for a classifier, like the notebooks'
+        CustomImageDataset: the label is the index of the card's value in
+        card_codec.FEATURE_VALUES[label_feature].
+
+        Returns:
+            tuple: Lists of absolute paths and integer labels.
+        """
+        values = FEATURE_VALUES[label_feature]
+        rows = [row for row in self.rows(**filters) if row[label_feature] is not None]
+        return [row["path"] for row in rows], [values.index(row[label_feature]) for row in rows]
+
+
+if __name__ == "__main__":
+    with Catalog(".") as catalog:
+        start = time.perf_counter()
+        catalog.update(workers=os.cpu_count())
+        logger.info(f"Updated in {time.perf_counter() - start:.2f} s")
+
+        start = time.perf_counter()
+        paths = catalog.paths(directory="./data/original", color="purple", shape="oval")
+        logger.info(f"{len(paths)} purple ovals in data/original, queried in {(time.perf_counter() - start) * 1e3:.1f} ms")
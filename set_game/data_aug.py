@@ -1,21 +1,43 @@
+import io
 import os
-import uuid
 import logging
+import multiprocessing
+import multiprocessing.connection
+import traceback
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+import cv2
 import numpy as np
 import imgaug.augmenters as iaa
 from PIL import Image
 
+from card_codec import FEATURE_VALUES, SHAPE_BY_CODE, code_to_id, feature, id_to_features, parse_filename
+from image_cache import ImageCache, init_worker_cache, worker_cache
+from packed_dataset import ShardWriter
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def augment_image_directory(input_directory, output_directory, num_images_per_file=10, target_char=None):
-    if not os.path.exists(output_directory):
-        os.makedirs(output_directory)
+# Datasets built by build_datasets: output directory -> card feature whose
+# value names the class directory
+DATASET_FEATURES = {
+    "dataset_shape": "shape",
+    "dataset_number": "number",
+    "dataset_filling": "shading",
+}
+
+# Augmented images per source image in each split
+SPLITS = (("test", 3), ("valid", 3), ("train", 10))
 
-    # Define the augmentations
-    seq = iaa.Sequential(
+IMAGE_EXTENSIONS = (".jpg", ".png", ".jpeg")
+
+
+def build_augmenter():
+    """Return the augmentation pipeline used for all datasets."""
+    return iaa.Sequential(
         [
             iaa.Affine(rotate=(-25, 25)),  # rotate image
             iaa.AdditiveGaussianNoise(scale=(10, 60)),  # add noise
@@ -25,137 +47,467 @@ def augment_image_directory(input_directory, output_directory, num_images_per_fi
             iaa.Affine(scale={"x": (0.8, 1.2), "y": (0.8, 1.2)}),  # scale image
         ]
     )
-    # Process each image in the input directory
-    for i, file_name in enumerate(os.listdir(input_directory), start=1):
-        # Check if the file matches the target character
-        if target_char and len(file_name) > 3 and file_name[3].upper() != target_char.upper():
-            continue
-        
-        image_path = os.path.join(input_directory, file_name)
 
-        logger.info(f"Processing file {i} - {file_name}")
 
-        # Check if the file is an image
-        if not (
-            file_name.endswith(".jpg")
-            or file_name.endswith(".png")
-            or file_name.endswith(".jpeg")
-        ):
+def load_rgb(image_path, cache=None):
+    """Return an image as an RGB array, read from an ImageCache if given."""
+    if cache is not None:
+        return cache.get(image_path, rgb=True)
+    with Image.open(image_path) as img:
+        return np.array(img)
+
+
+def source_paths(input_directory, target_char=None, catalog=None):
+    """
+    Return the image paths of a directory, optionally only cards of one shape.
+
+    Args:
+        input_directory (str): Directory of images named by card code.
+        target_char (str): Shape code ("D", "S" or "O") to keep, or None.
+        catalog (Catalog): Query this corpus catalog instead of listing the
+            directory and parsing the file names. Files added since its last
+            update are not seen.
+
+    Returns:
+        list: Sorted image paths.
+    """
+    target_shape = SHAPE_BY_CODE[target_char.upper()] if target_char else None
+    if catalog is not None:
+        return catalog.paths(directory=input_directory, shape=target_shape)
+    paths = []
+    for file_name in sorted(os.listdir(input_directory)):
+        if not file_name.endswith(IMAGE_EXTENSIONS):
             continue
+        # Check if the file matches the target shape
+        if target_shape:
+            card_id = parse_filename(file_name)
+            if card_id is None or feature(card_id, "shape") != target_shape:
+                continue
+        paths.append(os.path.join(input_directory, file_name))
+    return paths
+
+
+def source_label(image_path, label_feature="shape"):
+    """
+    Return the label of an image from the card code in its file name: the
+    index of its value in FEATURE_VALUES[label_feature], or the card id if
+    label_feature is None (-1 for names without a card code).
+    """
+    card_id = parse_filename(os.path.basename(image_path))
+    if card_id is None:
+        return -1
+    if label_feature is None:
+        return card_id
+    return FEATURE_VALUES[label_feature].index(feature(card_id, label_feature))
+
+
+def _augmented_batches(image_paths, labels, first_batch, step, num_batches, batch_size, shuffle, seed, cache, size):
+    """
+    Generate batches first_batch, first_batch + step, ... of the stream.
+
+    Batch b only depends on seed and b: it draws its sources at random, or
+    takes the next batch_size sources of the repeated source list if not
+    shuffle, and seeds the augmenter from its own generator.
+    """
+    seq = build_augmenter()
+    sources = {}
+    keys = [os.path.splitext(os.path.basename(path))[0] for path in image_paths]
+    batch = first_batch
+    while num_batches is None or batch < num_batches:
+        rng = np.random.default_rng([seed, batch])
+        if shuffle:
+            positions = rng.integers(len(image_paths), size=batch_size)
+        else:
+            positions = batch * batch_size + np.arange(batch_size)
+        indices = positions % len(image_paths)
+
+        for index in indices:
+            if index not in sources:
+                # Each worker decodes a source once
+                image = np.ascontiguousarray(load_rgb(image_paths[index], cache))
+                if size is not None:
+                    image = cv2.resize(image, tuple(size), interpolation=cv2.INTER_AREA)
+                sources[index] = image
+        seq.seed_(int(rng.integers(2**31)))
+        images = seq(images=[sources[index] for index in indices])
+        if all(image.shape == images[0].shape for image in images):
+            images = np.stack(images)
+
+        batch_keys = [f"{keys[index]}_{position // len(image_paths):03d}" for index, position in zip(indices, positions)]
+        yield images, labels[indices], batch_keys
+        batch += step
 
-        # Open the image file
-        img = Image.open(image_path)
-        img_np = np.array(img)
-        base_name = os.path.splitext(file_name)[0]
-
-        # Generate augmented images
-        for i in range(num_images_per_file):
-            tag = str(uuid.uuid4())
-            aug_img_np = seq(image=img_np)
-            aug_img = Image.fromarray(aug_img_np)
-            new_file_name = f"{base_name}_{tag}.jpg"
+
+def _stream_worker(connection, slots, stop, worker, workers, args):
+    """
+    Send this worker's batches to the consumer until done or stopped, then
+    None. If augmenting fails, send the traceback instead, as a string, so
+    that the consumer can raise it. slots bounds the batches in flight.
+    """
+    try:
+        for item in _augmented_batches(*args[:2], worker, workers, *args[2:]):
+            while not slots.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            if stop.is_set():
+                return
+            connection.send(item)
+        connection.send(None)
+    except Exception:
+        try:
+            connection.send(traceback.format_exc())
+        except OSError:
+            pass
+    finally:
+        connection.close()
+
+
+def stream_augmented(image_paths, label_feature="shape", batch_size=16, shuffle=True, num_batches=None, seed=0, workers=None, prefetch=8, cache=None, size=None, with_keys=False):
+    """
+    Yield batches of augmented images without writing them to disk.
+
+    Worker processes decode each source once, augment batches with imgaug's
+    batch API and send them through pipes, so that consumers get an
+    endless stream of fresh augmentations while the workers stay at most
+    prefetch batches ahead. Batches are reproducible from seed, but with
+    several workers they arrive in any order.
+
+    Args:
+        image_paths (list): Source images named by card code.
+        label_feature (str): Feature used as label (see source_label), or
+            None for the card id.
+        batch_size (int): Images per batch.
+        shuffle (bool): Draw sources at random. Otherwise cycle through
+            image_paths in order, so every source appears equally often.
+        num_batches (int): Number of batches, or None for an endless stream.
+        seed (int): Seed of the stream.
+        workers (int): Number of worker processes, 0 to augment in this
+            process. Defaults to the CPU count.
+        prefetch (int): Largest number of batches sent ahead of the consumer.
+        cache (ImageCache): Read decoded sources from this cache.
+        size (tuple): (width, height) to resize sources to before augmenting.
+        with_keys (bool): Also yield the name of every image, e.g. "1RES_003"
+            for the fourth use of 1RES.jpg.
+
+    Yields:
+        tuple: Images as an (N, H, W, 3) uint8 RGB array (a list if the sources
+        differ in size), labels as an (N,) array and, if with_keys is set, the
+        image names.
+    """
+    image_paths = list(image_paths)
+    labels = np.array([source_label(path, label_feature) for path in image_paths])
+    args = (image_paths, labels, num_batches, batch_size, shuffle, seed, cache, size)
+
+    if workers == 0:
+        for images, batch_labels, keys in _augmented_batches(image_paths, labels, 0, 1, *args[2:]):
+            yield (images, batch_labels, keys) if with_keys else (images, batch_labels)
+        return
+
+    workers = workers or os.cpu_count()
+    slots = multiprocessing.Semaphore(prefetch)
+    stop = multiprocessing.Event()
+    # One pipe per worker, rather than a shared queue: when a worker dies,
+    # even in the middle of sending a batch, its pipe reports end of file
+    # instead of blocking the consumer forever
+    connections = {}
+    processes = []
+    for worker in range(workers):
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_stream_worker, args=(writer, slots, stop, worker, workers, args), daemon=True)
+        process.start()
+        # Close this process's copy, so that only the worker holds the write end
+        writer.close()
+        connections[reader] = process
+        processes.append((reader, process))
+    try:
+        while connections:
+            for reader in multiprocessing.connection.wait(list(connections)):
+                try:
+                    item = reader.recv()
+                except (EOFError, OSError):
+                    # OSError if it died part way through a batch
+                    process = connections.pop(reader)
+                    process.join()
+                    raise RuntimeError(f"Augmentation worker exited with code {process.exitcode}")
+                if item is None:
+                    del connections[reader]
+                    continue
+                if isinstance(item, str):
+                    raise RuntimeError(f"Augmentation worker failed:\n{item}")
+                slots.release()
+                images, batch_labels, keys = item
+                yield (images, batch_labels, keys) if with_keys else (images, batch_labels)
+    finally:
+        stop.set()
+        # Drain the pipes so that workers blocked on a send can see stop
+        open_readers = [reader for reader, _ in processes]
+        while open_readers:
+            for reader in multiprocessing.connection.wait(open_readers, timeout=0.1):
+                try:
+                    reader.recv()
+                except (EOFError, OSError):
+                    open_readers.remove(reader)
+                    reader.close()
+        for _, process in processes:
+            process.join()
+
+
+def write_augmented(image_paths, output_directory, num_images_per_file=10, seed=None, workers=None, batch_size=16, cache=None):
+    """
+    Write num_images_per_file augmentations of every source image, as a
+    consumer of stream_augmented.
+
+    Files are named "<source>_<seed>_<index>.jpg": a new random seed gives
+    new images next to earlier ones, and a fixed seed reproduces them.
+
+    Args:
+        image_paths (list): Source images.
+        output_directory (str): Directory to write to.
+        num_images_per_file (int): Augmented images per source.
+        seed (int): Seed of the augmentations, or None for a random one.
+        workers (int): Number of worker processes, 0 to augment in this process.
+        batch_size (int): Images augmented per imgaug call.
+        cache (ImageCache): Read decoded sources from this cache.
+
+    Returns:
+        int: Number of images written.
+    """
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+    if not image_paths:
+        return 0
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+
+    total = len(image_paths) * num_images_per_file
+    num_batches = -(-total // batch_size)
+    stream = stream_augmented(image_paths, None, batch_size, shuffle=False, num_batches=num_batches, seed=seed, workers=workers, cache=cache, with_keys=True)
+    written = 0
+    for images, _, keys in stream:
+        for aug_img_np, key in zip(images, keys):
+            base_name, index = key.rsplit("_", 1)
+            # The last batch runs past the requested number of images
+            if int(index) >= num_images_per_file:
+                continue
+            new_file_name = f"{base_name}_{seed:08x}_{index}.jpg"
             logger.info(f"Saving {new_file_name}")
-            aug_img.save(os.path.join(output_directory, new_file_name))
+            Image.fromarray(aug_img_np).save(os.path.join(output_directory, new_file_name))
+            written += 1
+    return written
 
 
-def augment_image(image_path, output_directory, num_images_per_file=10):
-    # Define the augmentations
-    seq = iaa.Sequential(
-        [
-            iaa.Affine(rotate=(-25, 25)),  # rotate image
-            iaa.AdditiveGaussianNoise(scale=(10, 60)),  # add noise
-            iaa.Crop(percent=(0, 0.2)),  # crop image
-            iaa.LinearContrast((0.5, 2.0)),  # change contrast
-            iaa.Multiply((0.8, 1.2)),  # change brightness
-            iaa.Affine(scale={"x": (0.8, 1.2), "y": (0.8, 1.2)}),  # scale image
-        ]
-    )
-    file_name = image_path.split("/")[-1]
+def augment_image_directory(input_directory, output_directory, num_images_per_file=10, target_char=None, cache=None, seed=None, workers=None, catalog=None):
+    paths = source_paths(input_directory, target_char, catalog)
+    logger.info(f"Processing {len(paths)} files from {input_directory}")
+    return write_augmented(paths, output_directory, num_images_per_file, seed=seed, workers=workers, cache=cache)
+
+
+def augment_image(image_path, output_directory, num_images_per_file=10, cache=None, seed=None):
+    file_name = os.path.basename(image_path)
     logger.info(f"Processing file {file_name}")
 
     # Check if the file is an image
-    if not (
-        file_name.endswith(".jpg")
-        or file_name.endswith(".png")
-        or file_name.endswith(".jpeg")
-    ):
+    if not file_name.endswith(IMAGE_EXTENSIONS):
         raise TypeError
 
-    # Open the image file
-    img = Image.open(image_path)
-    img_np = np.array(img)
+    return write_augmented([image_path], output_directory, num_images_per_file, seed=seed, workers=0, cache=cache)
+
+
+def file_seed(file_name, seed=0):
+    """Return the augmentation seed of a source file, independent of processing order."""
+    return int(np.random.SeedSequence([seed, zlib.crc32(file_name.encode())]).generate_state(1)[0])
+
+
+def _init_engine(writer_threads, cache_config=None):
+    """Build the augmenter and the writer pool, and open the image cache, once per worker process."""
+    global _SEQ, _WRITER
+    _SEQ = build_augmenter()
+    _WRITER = ThreadPoolExecutor(max_workers=writer_threads)
+    init_worker_cache(cache_config)
+
+
+def _save_jpeg(image, path):
+    Image.fromarray(image).save(path)
+
+
+def _encode_jpeg(image):
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def augment_source(image_path, targets, seed=0, batch_size=16, cache=None, packed=False):
+    """
+    Augment one source image for every target directory it feeds.
+
+    The source is read once, augmented in batches with the worker's
+    pipeline seeded from the file name, and the JPEGs are encoded and
+    written by the worker's writer threads. Runs in a build_datasets worker.
+
+    Args:
+        image_path (str): Path to the source image.
+        targets (list): (output directory, number of images) pairs.
+        seed (int): Root seed of the datasets.
+        batch_size (int): Images augmented per imgaug call.
+        cache (ImageCache): Read the decoded image from this cache.
+            Defaults to the worker's cache, if any.
+        packed (bool): Return the encoded images instead of writing them.
+
+    Returns:
+        int: Number of images written, or, if packed, a list of
+        (output path, JPEG bytes) pairs.
+    """
+    file_name = os.path.basename(image_path)
     base_name = os.path.splitext(file_name)[0]
+    img_np = np.ascontiguousarray(load_rgb(image_path, cache if cache is not None else worker_cache()))
+
+    # One output path per augmented image, numbered within each directory
+    paths = [
+        os.path.join(output_directory, f"{base_name}_{index:03d}.jpg")
+        for output_directory, count in targets
+        for index in range(count)
+    ]
+
+    _SEQ.seed_(file_seed(file_name, seed))
+    writes = []
+    for start in range(0, len(paths), batch_size):
+        batch = paths[start:start + batch_size]
+        for aug_img_np, path in zip(_SEQ(images=[img_np] * len(batch)), batch):
+            if packed:
+                writes.append(_WRITER.submit(_encode_jpeg, aug_img_np))
+            else:
+                writes.append(_WRITER.submit(_save_jpeg, aug_img_np, path))
+    if packed:
+        return list(zip(paths, (write.result() for write in writes)))
+    for write in writes:
+        write.result()
+    logger.info(f"Wrote {len(paths)} augmented images of {file_name}")
+    return len(paths)
+
+
+def build_datasets(input_directory, output_root=".", datasets=tuple(DATASET_FEATURES), splits=SPLITS, seed=0, workers=None, writer_threads=4, batch_size=16, cache=None, packed=False, shard_size=1024, catalog=None):
+    """
+    Build augmented datasets for several card features in one pass.
+
+    Each source image is read once and augmented for every dataset and
+    split, in a process pool. Files are named after the source and a
+    running index, and every source has its own seed, so the output only
+    depends on seed and the inputs.
+
+    In packed mode every dataset split is a packed_dataset directory of
+    shards instead of a tree of loose JPEGs. Sources already packed are
+    skipped, so an interrupted build can be run again to resume it.
+
+    Args:
+        input_directory (str): Directory of source images named by card code.
+        output_root (str): Directory in which the datasets are created.
+        datasets (tuple): Keys of DATASET_FEATURES to build.
+        splits (tuple): (split name, images per source) pairs.
+        seed (int): Root seed of the augmentations.
+        workers (int): Number of worker processes. Defaults to the CPU count.
+        writer_threads (int): JPEG writer threads per worker process.
+        batch_size (int): Images augmented per imgaug call.
+        cache (ImageCache): Read decoded images from this cache, decoding
+            missing ones first.
+        packed (bool): Write sharded packed datasets.
+        shard_size (int): Samples per shard in packed mode.
+        catalog (Catalog): Find the sources in this corpus catalog instead
+            of listing input_directory. Files added since its last update are
+            not seen.
+
+    Returns:
+        int: Number of images written.
+    """
+    writers = {}
+    if packed:
+        for dataset in datasets:
+            classes = FEATURE_VALUES[DATASET_FEATURES[dataset]]
+            for split, _ in splits:
+                writers[os.path.join(output_root, dataset, split)] = ShardWriter(os.path.join(output_root, dataset, split), classes, shard_size)
+
+    tasks = []
+    for image_path in source_paths(input_directory, catalog=catalog):
+        file_name = os.path.basename(image_path)
+        card_id = parse_filename(file_name)
+        if card_id is None:
+            continue
+        targets = []
+        done = packed
+        for dataset in datasets:
+            class_name = str(feature(card_id, DATASET_FEATURES[dataset]))
+            for split, count in splits:
+                output_directory = os.path.join(output_root, dataset, split, class_name)
+                if packed:
+                    key = f"{class_name}/{os.path.splitext(file_name)[0]}_{count - 1:03d}.jpg"
+                    done = done and key in writers[os.path.join(output_root, dataset, split)].keys
+                else:
+                    os.makedirs(output_directory, exist_ok=True)
+                targets.append((output_directory, count))
+        # Sources already packed are skipped; partly packed ones are augmented
+        # again in full, so that their images match an uninterrupted build
+        if not done:
+            tasks.append((image_path, targets))
+
+    workers = workers or os.cpu_count()
+    if cache is not None:
+        cache.warm([image_path for image_path, _ in tasks], workers)
+
+    # Workers open the cache once from its settings rather than receive it with every source
+    cache_config = cache.config() if cache is not None else None
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_engine, initargs=(writer_threads, cache_config)) as executor:
+        if not packed:
+            futures = [executor.submit(augment_source, image_path, targets, seed, batch_size, None, packed) for image_path, targets in tasks]
+            written = sum(future.result() for future in futures)
+        else:
+            written = 0
+            # A bounded window of sources in flight, so that at most a few
+            # sources' JPEGs are held in memory at once. Results are
+            # appended in submission order, so the shards do not depend on
+            # scheduling.
+            pending = deque()
+            remaining = iter(tasks)
+            while True:
+                while len(pending) < 2 * workers and (task := next(remaining, None)) is not None:
+                    image_path, targets = task
+                    pending.append(executor.submit(augment_source, image_path, targets, seed, batch_size, None, packed))
+                if not pending:
+                    break
+                for path, data in pending.popleft().result():
+                    class_dir, file_name = os.path.split(path)
+                    split_dir, class_name = os.path.split(class_dir)
+                    writer = writers[split_dir]
+                    key = f"{class_name}/{file_name}"
+                    if key not in writer.keys:
+                        writer.append(data, writer.classes.index(class_name), key)
+                        written += 1
+            for writer in writers.values():
+                writer.close()
+    logger.info(f"Wrote {written} images from {len(tasks)} sources")
+    return written
 
-    # Generate augmented images
-    for i in range(num_images_per_file):
-        tag = str(uuid.uuid4())
-        aug_img_np = seq(image=img_np)
-        aug_img = Image.fromarray(aug_img_np)
-        new_file_name = f"{base_name}_{tag}.jpg"
-        logger.info(f"Saving {new_file_name}")
-        aug_img.save(os.path.join(output_directory, new_file_name))
-
-
-cards = [
-    (1, "oval", "solid", "red"),
-    (2, "diamond", "striped", "green"),
-    (3, "squiggle", "open", "purple"),
-    # ... include all identified cards
-]
-
-# Dictionary to map shorthand codes to their full names
-feature_map = {
-    "R": "Red",
-    "E": "Empty",  # Assuming 'E' stands for 'Empty'
-    "S": "Squiggle",
-    "D": "Diamond",
-    "O": "Oval"
-}
 
 def translate_card_id(card_id):
-    # Extract the individual components from the card ID
-    number = int(card_id[0])
-    color_code = card_id[1]
-    shading_code = card_id[2]
-    shape_code = card_id[3]
-
-    # Find the corresponding card in the cards list
-    for card in cards:
-        if card[0] == number:
-            shape = card[1]
-            shading = card[2]
-            color = card[3]
-            break
-    else:
+    """
+    Translate a short card code such as "1RES" into its full name, e.g.
+    "1RedOpenSquiggle".
+    """
+    try:
+        number, shape, shading, color = id_to_features(code_to_id(card_id))
+    except KeyError:
         return "Card not found"
 
-    # Construct the full name using the feature map and the card features
-    color_full = feature_map.get(color_code.upper(), color)
-    shading_full = feature_map.get(shading_code.upper(), shading)
-    shape_full = feature_map.get(shape_code.upper(), shape)
-
-    return f"{number}{color_full}{shading_full}{shape_full}"
+    return f"{number}{color.capitalize()}{shading.capitalize()}{shape.capitalize()}"
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     input_directory = f"./data/original_compressed"
-
+    # Decode each source once across all splits and shapes
+    cache = ImageCache("./.image_cache")
 
     outputs = ['dataset_shape'] #, 'dataset_number', 'dataset_filling']
-    for output_dir in outputs:
-        shapes = ['S', 'D', 'O']
-        for shape in shapes:
-            target_char = shape
-            dic_shape = {"S":"squiggle", "O":"oval", "D":"diamond" }
-            target_name = dic_shape[target_char] # -> squiggle
-
-            s = [('test', 3), ('valid', 3), ('train', 10)]
-
-            for dir_name, num_images in s:
-                output_directory = f"./{output_dir}/{dir_name}/{target_name}"
-                logger.info(f"Saving to {output_directory}")
-                augment_image_directory(input_directory, output_directory, num_images_per_file=num_images, target_char=target_char)
+    build_datasets(input_directory, datasets=outputs, splits=SPLITS, cache=cache)
+    cache.flush()
 
 
 # if __name__ == "__main__":
@@ -163,7 +515,7 @@ if __name__ == "__main__":
 #     set_id = "1RES"
 #     input_directory = f"./data/here"
 #     set_full = translate_card_id(set_id)
-#     # set_full = "1RedEmptySquiggle"
+#     # set_full = "1RedOpenSquiggle"
 #     output_directory = f"./dataset/valid/{set_full}"
 #     logging.info(f"Saving to {output_directory}")
 #     image_path = f"./data/original/{set_id}.jpg"
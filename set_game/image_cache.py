@@ -0,0 +1,258 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# cv2.imread flags that decode at 1/1, 1/2, 1/4 and 1/8 scale
+REDUCED_READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+INDEX_NAME = "index.json"
+
+# The cache of a worker process, opened once by init_worker_cache
+_worker_cache = None
+
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def decode_image(path, reduction=1, size=None):
+    """
+    Decode an image as BGR uint8, optionally at reduced scale and resized.
+
+    Args:
+        path (str): Path to the image file.
+        reduction (int): Scale divisor (1, 2, 4 or 8) applied while decoding.
+        size (tuple): Optional (width, height) to resize to.
+
+    Returns:
+        np.array: BGR image.
+    """
+    image = cv2.imread(path, REDUCED_READ_FLAGS[reduction])
+    if image is None:
+        raise ValueError(f"Image at path {path} could not be loaded.")
+    if size is not None and (image.shape[1], image.shape[0]) != tuple(size):
+        image = cv2.resize(image, tuple(size), interpolation=cv2.INTER_AREA)
+    return image
+
+
+def _decode_to_store(path, digest, array_path, reduction, size):
+    """Decode one image into the store. Runs in a worker process for warm."""
+    if not os.path.exists(array_path):
+        image = decode_image(path, reduction, size)
+        temp_path = f"{array_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.save(f, image)
+        os.replace(temp_path, array_path)
+    return path, digest, os.path.getsize(array_path)
+
+
+def _warm_one(path, digest, array_path, reduction, size):
+    """_decode_to_store for warm, returning the error message instead of raising for an unreadable file."""
+    try:
+        return _decode_to_store(path, digest, array_path, reduction, size)
+    except ValueError as e:
+        return path, digest, str(e)
+
+
+class ImageCache:
+    """
+    Persistent store of decoded images as memory-mapped .npy arrays.
+
+    Arrays are stored by content hash under a directory per decode setting
+    (reduction and size), so identical files share one array. An index maps
+    each source path to its mtime, file size and content hash: a source
+    whose mtime and size are unchanged is not read again, one whose content
+    changed is decoded again. When the arrays exceed max_bytes the least
+    recently used ones are deleted.
+
+    get returns a read-only memory-mapped view, so repeated reads cost no
+    decode and no copy. The index is written by flush (and on leaving a
+    with block); a single process should write to a cache directory at a
+    time, while any number may read it.
+    """
+
+    def __init__(self, cache_directory, reduction=1, size=None, max_bytes=2 << 30):
+        """
+        Args:
+            cache_directory (str): Root directory of the cache.
+            reduction (int): Scale divisor (1, 2, 4 or 8) applied while decoding.
+            size (tuple): Optional (width, height) to resize images to, such
+                as a model's input size.
+            max_bytes (int): Largest total size of the stored arrays.
+        """
+        self.cache_directory = cache_directory
+        self.reduction = reduction
+        self.size = tuple(size) if size is not None else None
+        self.max_bytes = max_bytes
+        setting = f"r{reduction}" + (f"_{self.size[0]}x{self.size[1]}" if self.size else "")
+        self.directory = os.path.join(cache_directory, setting)
+        os.makedirs(self.directory, exist_ok=True)
+        self.index_path = os.path.join(self.directory, INDEX_NAME)
+        self.paths = {}
+        self.arrays = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.paths = index["paths"]
+            self.arrays = index["arrays"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def config(self):
+        """Return the arguments that open this cache, to pass to init_worker_cache."""
+        return self.cache_directory, self.reduction, self.size, self.max_bytes
+
+    def _array_path(self, digest):
+        return os.path.join(self.directory, f"{digest}.npy")
+
+    def _lookup(self, path):
+        """Return the content hash of a source, hashing it only if it changed."""
+        stat = os.stat(path)
+        entry = self.paths.get(path)
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return entry["hash"]
+        digest = file_hash(path)
+        self.paths[path] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "hash": digest}
+        return digest
+
+    def get(self, path, rgb=False):
+        """
+        Return the decoded image of a source file, decoding it on a miss.
+
+        Args:
+            path (str): Path to the image file.
+            rgb (bool): Return the channels in RGB order (a reversed view).
+
+        Returns:
+            np.array: Read-only BGR (or RGB) image backed by the cache file.
+        """
+        path = os.path.abspath(path)
+        digest = self._lookup(path)
+        array_path = self._array_path(digest)
+        if digest not in self.arrays or not os.path.exists(array_path):
+            _, _, nbytes = _decode_to_store(path, digest, array_path, self.reduction, self.size)
+            self.arrays[digest] = {"bytes": nbytes}
+        self.arrays[digest]["last_used"] = time.time()
+        image = np.load(array_path, mmap_mode="r")
+        return image[:, :, ::-1] if rgb else image
+
+    def warm(self, paths, workers=None):
+        """
+        Decode every uncached source across a process pool and flush the index.
+
+        Sources that cannot be decoded are logged and skipped; get raises
+        ValueError for them, as decode_image does. Warm the cache before
+        starting worker processes that read it, so that they open an index
+        that already has every source.
+
+        Args:
+            paths (list): Paths to image files.
+            workers (int): Number of worker processes. None or 1 decodes the
+                images in this process.
+        """
+        tasks = []
+        for path in map(os.path.abspath, paths):
+            digest = self._lookup(path)
+            if digest not in self.arrays or not os.path.exists(self._array_path(digest)):
+                tasks.append((path, digest, self._array_path(digest), self.reduction, self.size))
+        failed = 0
+        if workers is None or workers <= 1 or not tasks:
+            results = [_warm_one(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_warm_one, *zip(*tasks)))
+        for path, digest, result in results:
+            if isinstance(result, str):
+                logger.warning(f"Skipping {path}: {result}")
+                failed += 1
+                continue
+            self.arrays[digest] = {"bytes": result, "last_used": time.time()}
+        logger.info(f"Decoded {len(tasks) - failed} of {len(paths)} images into {self.directory}")
+        self.flush()
+
+    def invalidate(self, path):
+        """Forget a source file and delete its array if no other source uses it."""
+        entry = self.paths.pop(os.path.abspath(path), None)
+        if entry and not any(other["hash"] == entry["hash"] for other in self.paths.values()):
+            self._remove_array(entry["hash"])
+
+    def _remove_array(self, digest):
+        self.arrays.pop(digest, None)
+        try:
+            os.remove(self._array_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Delete least recently used arrays until the store fits in max_bytes."""
+        total = sum(entry["bytes"] for entry in self.arrays.values())
+        for digest, entry in sorted(self.arrays.items(), key=lambda item: item[1].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            total -= entry["bytes"]
+            self._remove_array(digest)
+        self.paths = {path: entry for path, entry in self.paths.items() if entry["hash"] in self.arrays}
+
+    def flush(self):
+        """Evict if needed and write the index atomically."""
+        self.evict()
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"paths": self.paths, "arrays": self.arrays}, f)
+        os.replace(temp_path, self.index_path)
+
+    def total_bytes(self):
+        """Return the total size of the stored arrays."""
+        return sum(entry["bytes"] for entry in self.arrays.values())
+
+
+def init_worker_cache(config):
+    """
+    Pool initializer: open the cache described by config (see
+    ImageCache.config) once in this worker process.
+
+    Workers then get only the cache's settings rather than a pickled cache
+    with its whole index in every task.
+    """
+    global _worker_cache
+    _worker_cache = ImageCache(*config) if config is not None else None
+
+
+def worker_cache():
+    """Return the cache opened by init_worker_cache in this process, or None."""
+    return _worker_cache
+
+
+if __name__ == "__main__":
+    directory = "./data/original"
+    paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+    with ImageCache("./.image_cache") as cache:
+        cache.warm(paths, os.cpu_count())
+        start = time.perf_counter()
+        for path in paths:
+            cache.get(path)
+        logger.info(f"Read {len(paths)} cached images in {time.perf_counter() - start:.3f} s ({cache.total_bytes() / 2**20:.0f} MiB)")
@@ -0,0 +1,225 @@
+import io
+import json
+import logging
+import os
+
+import numpy as np
+from PIL import Image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# One index record per sample: where its encoded bytes are in the shard's
+# data file, its class label and its name (e.g. "oval/1GEO_000.jpg")
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("label", "<i4"), ("key", "S64")])
+
+META_NAME = "meta.json"
+
+
+def _shard_paths(directory, shard):
+    stem = os.path.join(directory, f"shard-{shard:05d}")
+    return f"{stem}.bin", f"{stem}.idx"
+
+
+def _read_index(index_path):
+    """Read the complete records of a shard index, ignoring a partial last one."""
+    size = os.path.getsize(index_path)
+    count = size // INDEX_DTYPE.itemsize
+    return np.fromfile(index_path, dtype=INDEX_DTYPE, count=count)
+
+
+class ShardWriter:
+    """
+    Append-only writer of a packed dataset.
+
+    Samples are encoded images appended to fixed-size shards. Each shard is
+    a data file of concatenated bytes and an index file of INDEX_DTYPE
+    records. A record is written after its bytes, so opening an existing
+    dataset drops anything past the last complete record and carries on
+    appending: an interrupted build resumes where it stopped.
+    """
+
+    def __init__(self, directory, classes, shard_size=1024):
+        """
+        Args:
+            directory (str): Directory of the dataset.
+            classes (list): Class names, indexed by label.
+            shard_size (int): Samples per shard.
+        """
+        self.directory = directory
+        self.classes = [str(name) for name in classes]
+        self.shard_size = shard_size
+        os.makedirs(directory, exist_ok=True)
+
+        meta_path = os.path.join(directory, META_NAME)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta["classes"] != self.classes or meta["shard_size"] != shard_size:
+                raise ValueError(f"Dataset at {directory} was written with different classes or shard size")
+        else:
+            with open(meta_path, "w") as f:
+                json.dump({"classes": self.classes, "shard_size": shard_size}, f)
+
+        self.keys = set()
+        self.shard = 0
+        while os.path.exists(_shard_paths(directory, self.shard + 1)[1]):
+            self.shard += 1
+        for shard in range(self.shard + 1):
+            index_path = _shard_paths(directory, shard)[1]
+            if os.path.exists(index_path):
+                self.keys.update(key.decode() for key in _read_index(index_path)["key"])
+        self._open_shard()
+
+    def _open_shard(self):
+        data_path, index_path = _shard_paths(self.directory, self.shard)
+        records = _read_index(index_path) if os.path.exists(index_path) else np.empty(0, dtype=INDEX_DTYPE)
+        end = int(records["offset"][-1] + records["length"][-1]) if len(records) else 0
+
+        # Drop a partial record or bytes written after the last record
+        self.data_file = open(data_path, "ab")
+        self.data_file.truncate(end)
+        self.index_file = open(index_path, "ab")
+        self.index_file.truncate(len(records) * INDEX_DTYPE.itemsize)
+        self.count = len(records)
+        self.offset = end
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, data, label, key):
+        """
+        Append one encoded sample.
+
+        Args:
+            data (bytes): Encoded image.
+            label (int): Class label.
+            key (str): Unique sample name, at most 64 bytes encoded.
+        """
+        encoded_key = key.encode()
+        # NumPy would silently truncate a longer key, so two keys could compare equal
+        if len(encoded_key) > INDEX_DTYPE["key"].itemsize:
+            raise ValueError(f"Sample key {key!r} is longer than {INDEX_DTYPE['key'].itemsize} bytes")
+        if self.count == self.shard_size:
+            self.close()
+            self.shard += 1
+            self._open_shard()
+
+        self.data_file.write(data)
+        self.data_file.flush()
+        record = np.array([(self.offset, len(data), label, encoded_key)], dtype=INDEX_DTYPE)
+        self.index_file.write(record.tobytes())
+        self.index_file.flush()
+        self.offset += len(data)
+        self.count += 1
+        self.keys.add(key)
+
+    def close(self):
+        self.data_file.close()
+        self.index_file.close()
+
+
+class PackedDataset:
+    """
+    Reader of a packed dataset, with random access and sequential iteration.
+
+    It has the same interface as the notebooks' CustomImageDataset, so it
+    can be passed to a PyTorch DataLoader: items are (RGB PIL image, label)
+    pairs, after an optional transform. Shard data files are memory-mapped,
+    so a read is a slice and a JPEG decode.
+    """
+
+    def __init__(self, directory, transform=None):
+        """
+        Args:
+            directory (str): Directory of the dataset.
+            transform (callable): Applied to every image, e.g. torchvision transforms.
+        """
+        self.directory = directory
+        self.transform = transform
+        with open(os.path.join(directory, META_NAME)) as f:
+            self.classes = json.load(f)["classes"]
+
+        indexes = []
+        shards = []
+        shard = 0
+        while os.path.exists(_shard_paths(directory, shard)[1]):
+            records = _read_index(_shard_paths(directory, shard)[1])
+            indexes.append(records)
+            shards.append(np.full(len(records), shard, dtype=np.int32))
+            shard += 1
+        self.index = np.concatenate(indexes) if indexes else np.empty(0, dtype=INDEX_DTYPE)
+        self.shards = np.concatenate(shards) if shards else np.empty(0, dtype=np.int32)
+        self.labels = self.index["label"]
+        self._data = [None] * shard
+
+    def _shard_data(self, shard):
+        # Mapped lazily, so that a dataset can be sent to DataLoader workers
+        if self._data[shard] is None:
+            self._data[shard] = np.memmap(_shard_paths(self.directory, shard)[0], dtype=np.uint8, mode="r")
+        return self._data[shard]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = [None] * len(self._data)
+        return state
+
+    def __len__(self):
+        return len(self.index)
+
+    def raw(self, idx):
+        """Return the encoded bytes, label and key of a sample."""
+        offset, length, label, key = self.index[idx]
+        data = self._shard_data(self.shards[idx])[offset:offset + length]
+        return data.tobytes(), int(label), key.decode()
+
+    def __getitem__(self, idx):
+        data, label, _ = self.raw(idx)
+        image = Image.open(io.BytesIO(data)).convert("RGB")
+        if self.transform:
+            image = self.transform(image)
+        return image, label
+
+    def __iter__(self):
+        # Samples are stored in index order, so this reads each shard sequentially
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+def pack_directory(root_dir, output_directory, classes, shard_size=1024):
+    """
+    Pack an existing dataset_*/split directory of class subdirectories.
+
+    Args:
+        root_dir (str): Directory with one subdirectory per class.
+        output_directory (str): Directory of the packed dataset.
+        classes (list): Class names, indexed by label.
+        shard_size (int): Samples per shard.
+
+    Returns:
+        int: Number of samples added.
+    """
+    added = 0
+    with ShardWriter(output_directory, classes, shard_size) as writer:
+        for label, class_name in enumerate(writer.classes):
+            class_dir = os.path.join(root_dir, class_name)
+            if not os.path.isdir(class_dir):
+                continue
+            for file_name in sorted(os.listdir(class_dir)):
+                key = f"{class_name}/{file_name}"
+                if not file_name.endswith((".jpg", ".jpeg", ".png")) or key in writer.keys:
+                    continue
+                with open(os.path.join(class_dir, file_name), "rb") as f:
+                    writer.append(f.read(), label, key)
+                added += 1
+    logger.info(f"Packed {added} images from {root_dir} into {output_directory}")
+    return added
+
+
+if __name__ == "__main__":
+    for split in ("train", "valid", "test"):
+        pack_directory(f"./dataset_shape/{split}", f"./packed/dataset_shape/{split}", ["diamond", "squiggle", "oval"])
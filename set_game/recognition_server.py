@@ -0,0 +1,310 @@
+import http.client
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from board_segment import segment_board, synthetic_board
+from card_hog import CardHOGClassifier
+from card_render import CARD_HEIGHT, CARD_WIDTH
+from colour_softmax import get_dominant_colors
+from set_card import set_positions
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Largest request body accepted, well above a full-resolution JPEG of a board
+MAX_BODY_BYTES = 32 * 1024 * 1024
+
+
+class MicroBatcher:
+    """
+    Gathers items submitted from many threads into batches for one worker.
+
+    The worker takes the first waiting item, then keeps collecting until
+    max_batch items are in hand or max_latency seconds have passed since
+    that first item arrived, and processes them with one call. If that call
+    fails, the items are processed one at a time, so that only the failing
+    ones get the exception.
+    """
+
+    def __init__(self, process, max_batch=64, max_latency=0.005):
+        """
+        Args:
+            process (callable): Maps a list of items to a list of results.
+            max_batch (int): Most items per batch.
+            max_latency (float): Longest wait for a batch to fill, in seconds.
+        """
+        self.process = process
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.queue = queue.Queue()
+        self.batch_sizes = deque(maxlen=1000)
+        self.thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        """Queue an item and return a Future of its result."""
+        future = Future()
+        self.queue.put((time.perf_counter(), item, future))
+        return future
+
+    def depth(self):
+        """Return the number of items waiting for a batch."""
+        return self.queue.qsize()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = batch[0][0] + self.max_latency
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                try:
+                    batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.batch_sizes.append(len(batch))
+            try:
+                results = self.process([item for _, item, _ in batch])
+            except Exception:
+                # Run the items one by one, so that a bad item only fails its own request
+                for _, item, future in batch:
+                    try:
+                        future.set_result(self.process([item])[0])
+                    except Exception as e:
+                        future.set_exception(e)
+                continue
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class Recogniser:
+    """
+    Holds the classifiers warm and runs the card crops of concurrent
+    requests through them in micro-batches: the colour classifier always,
+    and the attribute classifier, whose cards feed the set finder, when one
+    is given.
+    """
+
+    def __init__(self, colour_classifier=None, card_classifier=None, max_batch=64, max_latency=0.005):
+        """
+        Args:
+            colour_classifier (callable): Maps a list of BGR crops to (colour
+                name, confidences) pairs, like ColourLUT.predict_batch.
+                Defaults to colour_softmax.get_dominant_colors.
+            card_classifier (CardHOGClassifier): Classifies all four
+                attributes, so that Sets can be found.
+            max_batch (int): Most requests per batch.
+            max_latency (float): Longest wait for a batch to fill, in seconds.
+        """
+        self.colour_classifier = colour_classifier or (lambda images: get_dominant_colors(images, bgr=True))
+        self.card_classifier = card_classifier
+        self.batcher = MicroBatcher(self._classify, max_batch, max_latency)
+        self.latencies = deque(maxlen=1000)
+        self.requests = 0
+        self.lock = threading.Lock()
+        # Pay for imports, table builds and first calls before the first request
+        self._classify([np.full((1, CARD_HEIGHT, CARD_WIDTH, 3), 255, dtype=np.uint8)])
+
+    def _classify(self, items):
+        """Classify the crops of several requests in one call per classifier."""
+        crops = np.concatenate(items)
+        colours = self.colour_classifier(crops) if len(crops) else []
+        cards = self.card_classifier.predict_batch(crops, bgr=True) if self.card_classifier and len(crops) else [None] * len(crops)
+        results = []
+        start = 0
+        for item in items:
+            end = start + len(item)
+            results.append(list(zip(colours[start:end], cards[start:end])))
+            start = end
+        return results
+
+    def _respond(self, crops, received, extra):
+        queue_depth = self.batcher.depth()
+        results = self.batcher.submit(crops).result()
+        cards = []
+        for (colour, confidences), card in results:
+            entry = {"color": colour, "confidences": {name: float(value) for name, value in confidences.items()}}
+            if card is not None:
+                entry["card"] = dict(zip(("number", "shape", "shading", "color"), card)) | {"id": card.id}
+            cards.append(entry)
+        response = {"cards": cards, **extra}
+        if self.card_classifier:
+            # Positions in "cards" rather than card ids, which two crops may share
+            response["sets"] = [list(positions) for positions in set_positions([card.id for _, card in results])]
+
+        latency = time.perf_counter() - received
+        with self.lock:
+            self.latencies.append(latency)
+            self.requests += 1
+        response["latency_ms"] = latency * 1e3
+        response["queue_depth"] = queue_depth
+        return response
+
+    def recognise_card(self, image, received):
+        """Recognise one card image (BGR)."""
+        crop = cv2.resize(image, (CARD_WIDTH, CARD_HEIGHT), interpolation=cv2.INTER_AREA)
+        return self._respond(crop[None], received, {})
+
+    def recognise_board(self, image, received):
+        """Detect and recognise every card on a board photo (BGR), and find its Sets."""
+        crops, quads = segment_board(image)
+        return self._respond(crops, received, {"corners": quads.round(1).tolist()})
+
+    def stats(self):
+        """Return the request count, queue depth, mean requests per batch and latency percentiles."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            requests = self.requests
+        stats = {"requests": requests, "queue_depth": self.batcher.depth()}
+        if self.batcher.batch_sizes:
+            stats["mean_batch_requests"] = statistics.fmean(self.batcher.batch_sizes)
+        if latencies:
+            for percentile in (50, 90, 99):
+                stats[f"latency_p{percentile}_ms"] = latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)] * 1e3
+        return stats
+
+
+class RecognitionHandler(BaseHTTPRequestHandler):
+    """
+    POST /card or /board with an encoded image of at most MAX_BODY_BYTES as
+    the body; GET /stats. Responses are JSON.
+    """
+
+    recogniser = None
+
+    def do_POST(self):
+        received = time.perf_counter()
+        routes = {"/card": self.recogniser.recognise_card, "/board": self.recogniser.recognise_board}
+        if self.path not in routes:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        if self.headers["Content-Length"] is None:
+            self._send(411, {"error": "Content-Length is required"})
+            return
+        try:
+            length = int(self.headers["Content-Length"])
+        except ValueError:
+            self._send(400, {"error": "Content-Length is not a number"})
+            return
+        if length < 0:
+            self._send(400, {"error": "Content-Length is negative"})
+            return
+        if length > MAX_BODY_BYTES:
+            self._send(413, {"error": f"Body is larger than {MAX_BODY_BYTES} bytes"})
+            return
+        data = np.frombuffer(self.rfile.read(length), dtype=np.uint8)
+        image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if image is None:
+            self._send(400, {"error": "Body is not an image"})
+            return
+        try:
+            self._send(200, routes[self.path](image, received))
+        except Exception as e:
+            logger.exception("Recognition failed")
+            self._send(500, {"error": str(e)})
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send(200, self.recogniser.stats())
+        else:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "local"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(recogniser, host="127.0.0.1", port=8765, unix_socket=None):
+    """
+    Create the HTTP server, on a TCP port or a Unix socket path.
+
+    Returns:
+        socketserver.BaseServer: Call serve_forever() to run it.
+    """
+    handler = type("Handler", (RecognitionHandler,), {"recogniser": recogniser})
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        return ThreadingUnixHTTPServer(unix_socket, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """http.client connection to a server on a Unix socket."""
+
+    def __init__(self, path, timeout=30):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def post_image(connection, path, image):
+    """Send a BGR image as JPEG to the server and return the JSON response."""
+    connection.request("POST", path, cv2.imencode(".jpg", image)[1].tobytes(), {"Content-Type": "image/jpeg"})
+    return json.loads(connection.getresponse().read())
+
+
+def benchmark_server(clients=16, requests_per_client=10, unix_socket="/tmp/set_recognition.sock"):
+    """
+    Serve on a Unix socket in this process and print request latency and
+    batching for concurrent board requests.
+    """
+    server = make_server(Recogniser(), unix_socket=unix_socket)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    board, _ = synthetic_board(12, (1280, 960), seed=0)
+
+    def client(_):
+        connection = UnixHTTPConnection(unix_socket)
+        return [post_image(connection, "/board", board) for _ in range(requests_per_client)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        responses = [response for batch in executor.map(client, range(clients)) for response in batch]
+    elapsed = time.perf_counter() - start
+    connection = UnixHTTPConnection(unix_socket)
+    connection.request("GET", "/stats")
+    stats = json.loads(connection.getresponse().read())
+    print(f"{len(responses)} boards in {elapsed:.2f} s ({len(responses) / elapsed:.0f}/s), "
+          f"{len(responses[0]['cards'])} cards each; stats: {stats}")
+    server.shutdown()
+    server.server_close()
+    return stats
+
+
+if __name__ == "__main__":
+    card_classifier = CardHOGClassifier.load("./card_hog.npz") if os.path.exists("./card_hog.npz") else None
+    server = make_server(Recogniser(card_classifier=card_classifier))
+    logger.info(f"Serving on {server.server_address}; POST /card or /board, GET /stats")
+    server.serve_forever()
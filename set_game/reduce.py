@@ -1,7 +1,127 @@
 from PIL import Image
+import io
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 
-def compress_image(input_path, output_path, quality=20):
+import cv2
+import numpy as np
+
+from image_cache import file_hash, init_worker_cache, worker_cache
+
+MANIFEST_NAME = ".manifest.json"
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Settings that must match the manifest for a file to be skipped
+SETTINGS_KEYS = ("quality", "draft_scale", "max_bytes", "min_ssim", "min_psnr")
+
+
+def ssim(a, b, win_size=7):
+    """
+    Mean structural similarity of two grayscale uint8 images.
+    
+    Same definition as skimage.metrics.structural_similarity with its
+    defaults (uniform 7x7 window, sample covariances, borders excluded), on
+    OpenCV box filters.
+    """
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    cov_norm = win_size**2 / (win_size**2 - 1)
+
+    def mean(x):
+        return cv2.boxFilter(x, -1, (win_size, win_size), borderType=cv2.BORDER_REFLECT)
+
+    mu_a, mu_b = mean(a), mean(b)
+    var_a = cov_norm * (mean(a * a) - mu_a * mu_a)
+    var_b = cov_norm * (mean(b * b) - mu_b * mu_b)
+    cov = cov_norm * (mean(a * b) - mu_a * mu_b)
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a**2 + mu_b**2 + c1) * (var_a + var_b + c2))
+    pad = (win_size - 1) // 2
+    return float(ssim_map[pad:-pad, pad:-pad].mean(dtype=np.float64))
+
+
+def psnr(a, b):
+    """Peak signal-to-noise ratio of two uint8 images in dB."""
+    return cv2.PSNR(a, b)
+
+
+def encode_jpeg(img, quality):
+    """Encode a PIL image as JPEG in memory and return the bytes."""
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def search_quality(img, max_bytes=None, min_ssim=None, min_psnr=None, low=1, high=95):
+    """
+    Binary search the JPEG quality of an image for a size or fidelity target.
+    
+    Size grows and fidelity improves with quality, so with min_ssim or
+    min_psnr the lowest quality reaching them is chosen, and with max_bytes
+    the highest quality that fits (the lowest quality if none fits). With
+    both, the fidelity target is used unless it does not fit, in which case
+    the budget wins. Every try is encoded in memory.
+    
+    Args:
+        img (PIL.Image): Image to compress.
+        max_bytes (int): Largest encoded size.
+        min_ssim (float): Smallest structural similarity to the image (0-1),
+            on the luma channel.
+        min_psnr (float): Smallest peak signal-to-noise ratio in dB.
+        low (int): Lowest quality to consider.
+        high (int): Highest quality to consider.
+        
+    Returns:
+        tuple: Chosen quality and the encoded bytes.
+    """
+    reference = np.asarray(img.convert("RGB"))
+    reference_luma = np.asarray(img.convert("L"))
+    encodes = {}
+
+    def encode(quality):
+        if quality not in encodes:
+            encodes[quality] = encode_jpeg(img, quality)
+        return encodes[quality]
+
+    def good_enough(quality):
+        with Image.open(io.BytesIO(encode(quality))) as decoded:
+            if min_ssim is not None and ssim(reference_luma, np.asarray(decoded.convert("L"))) < min_ssim:
+                return False
+            if min_psnr is not None and psnr(reference, np.asarray(decoded.convert("RGB"))) < min_psnr:
+                return False
+        return True
+
+    def fits(quality):
+        return len(encode(quality)) <= max_bytes
+
+    quality = None
+    if min_ssim is not None or min_psnr is not None:
+        # Lowest quality that is good enough
+        lo, hi = low, high
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if good_enough(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        quality = lo
+    if max_bytes is not None and (quality is None or not fits(quality)):
+        # Highest quality that fits the budget
+        lo, hi = low, high if quality is None else quality
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if fits(mid):
+                lo = mid
+            else:
+                hi = mid - 1
+        quality = lo
+    return quality, encode(quality)
+
+
+def compress_image(input_path, output_path, quality=20, cache=None, draft_scale=1, max_bytes=None, min_ssim=None, min_psnr=None):
     """
     Compress an image by reducing its quality to save space.
     
@@ -9,49 +129,181 @@ def compress_image(input_path, output_path, quality=20):
         input_path (str): Path to the input image.
         output_path (str): Path to save the compressed image.
         quality (int): Quality of the output image (1-100). Lower means more compression.
+        cache (ImageCache): Read the decoded image from this cache, resized
+            to the draft_scale size if the cache decodes at another size.
+        draft_scale (int): Downscale by 1, 2, 4 or 8. JPEGs are decoded
+            directly at that scale with PIL's draft mode.
+        max_bytes (int): Instead of quality, use the highest quality that
+            fits in this many bytes (see search_quality).
+        min_ssim (float): Instead of quality, use the lowest quality with at
+            least this SSIM.
+        min_psnr (float): Instead of quality, use the lowest quality with at
+            least this PSNR in dB.
         
     Returns:
-        None
+        tuple: Quality used and size of the compressed image in bytes.
     """
-    # Open the image file
-    with Image.open(input_path) as img:
-        # Save the image with the specified quality
-        img.save(output_path, "JPEG", quality=quality)
-        print(f"Compressed image saved at {output_path} with quality={quality}")
+    if cache is not None:
+        image = cache.get(input_path, rgb=True)
+        # The cache decodes at its own reduction and size; match the size of the
+        # uncached path, so that the output follows draft_scale either way
+        with Image.open(input_path) as source:
+            size = (source.width // draft_scale, source.height // draft_scale)
+        if (image.shape[1], image.shape[0]) != size:
+            image = cv2.resize(np.ascontiguousarray(image), size, interpolation=cv2.INTER_AREA)
+        img = Image.fromarray(np.ascontiguousarray(image))
+    else:
+        # Open the image file
+        with Image.open(input_path) as source:
+            if draft_scale > 1:
+                size = (source.width // draft_scale, source.height // draft_scale)
+                # Decodes a JPEG at 1/2, 1/4 or 1/8 scale from the DCT coefficients
+                source.draft("RGB", size)
+                img = source.resize(size, Image.Resampling.BOX) if source.size != size else source.copy()
+            else:
+                img = source.copy()
 
-def compress_images_in_directory(input_directory, output_directory, quality=20):
+    if max_bytes is None and min_ssim is None and min_psnr is None:
+        data = encode_jpeg(img, quality)
+    else:
+        quality, data = search_quality(img, max_bytes, min_ssim, min_psnr)
+
+    # Save the image with the chosen quality
+    with open(output_path, "wb") as f:
+        f.write(data)
+    print(f"Compressed image saved at {output_path} with quality={quality}")
+    return quality, len(data)
+
+
+def _source_state(input_path, previous=None):
+    """Return the mtime, size and hash of a source, hashing only if it changed."""
+    stat = os.stat(input_path)
+    if previous and previous["source_mtime_ns"] == stat.st_mtime_ns and previous["source_size"] == stat.st_size:
+        digest = previous["source_hash"]
+    else:
+        digest = file_hash(input_path)
+    return {"source_mtime_ns": stat.st_mtime_ns, "source_size": stat.st_size, "source_hash": digest}
+
+
+def _compress_task(input_path, output_path, settings, state, cache=None):
+    """
+    Compress one file for compress_images_in_directory and return its
+    manifest entry. In a worker process the cache defaults to the worker's.
+    """
+    if cache is None:
+        cache = worker_cache()
+    output_quality, output_size = compress_image(input_path, output_path, cache=cache, **settings)
+    return dict(state, **settings, output_quality=output_quality, output_size=output_size)
+
+
+def compress_images_in_directory(input_directory, output_directory, quality=20, cache=None, workers=None, draft_scale=1, incremental=True, max_bytes=None, min_ssim=None, min_psnr=None, catalog=None):
     """
     Compress all images in the input directory and save them to the output directory.
     
+    A manifest in the output directory records the hash of each source, the
+    settings and the output size. Unless incremental is off, files whose
+    source, settings and output are unchanged are skipped without decoding.
+    
     Args:
         input_directory (str): Path to the directory containing input images.
         output_directory (str): Path to the directory to save compressed images.
         quality (int): Quality of the output images (1-100). Lower means more compression.
+        cache (ImageCache): Read decoded images from this cache, e.g. to try
+            several qualities without decoding again.
+        workers (int): Number of worker processes. None or 1 compresses the
+            images in this process.
+        draft_scale (int): Downscale by 1, 2, 4 or 8 while decoding.
+        incremental (bool): Skip files that are up to date in the manifest.
+        max_bytes (int): Per-image byte budget (see compress_image).
+        min_ssim (float): Per-image minimum SSIM (see compress_image).
+        min_psnr (float): Per-image minimum PSNR in dB (see compress_image).
+        catalog (Catalog): Take the file list from this corpus catalog, and
+            the source hashes when the manifest has none, instead of listing
+            the directory and hashing every new source. Files added since
+            its last update are not seen.
         
     Returns:
-        None
+        dict: Manifest entries of the files compressed in this run.
     """
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
-    for file_name in os.listdir(input_directory):
+    manifest_path = os.path.join(output_directory, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    settings = {"quality": quality, "draft_scale": draft_scale, "max_bytes": max_bytes, "min_ssim": min_ssim, "min_psnr": min_psnr}
+    tasks = []
+    skipped = 0
+    if catalog is not None:
+        known = {os.path.basename(row["path"]): row for row in catalog.rows(directory=input_directory)}
+        file_names = sorted(known)
+    else:
+        known = {}
+        file_names = sorted(os.listdir(input_directory))
+    for file_name in file_names:
         # Check if the file is an image
-        if not (file_name.endswith(".jpg") or file_name.endswith(".jpeg") or file_name.endswith(".png")):
+        if not file_name.endswith(IMAGE_EXTENSIONS):
             continue
         
         input_path = os.path.join(input_directory, file_name)
         output_path = os.path.join(output_directory, file_name)
-        
-        try:
-            compress_image(input_path, output_path, quality)
-        except Exception as e:
-            print(f"Failed to compress {file_name}: {e}")
+
+        previous = manifest.get(file_name)
+        row = known.get(file_name)
+        # The catalog's hash stands in for the manifest's, as long as its mtime and size still match
+        source = previous or row and {"source_mtime_ns": row["mtime_ns"], "source_size": row["size"], "source_hash": row["hash"]}
+        state = _source_state(input_path, source)
+        if (
+            incremental
+            and previous
+            and previous["source_hash"] == state["source_hash"]
+            and all(previous.get(key) == settings[key] for key in SETTINGS_KEYS)
+            and os.path.exists(output_path)
+            and os.path.getsize(output_path) == previous["output_size"]
+        ):
+            # Refresh the mtime in case only the timestamp changed
+            manifest[file_name] = dict(previous, **state)
+            skipped += 1
+            continue
+        tasks.append((file_name, (input_path, output_path, settings, state)))
+
+    if cache is not None and tasks:
+        # Decode into the cache here, so that the workers find every image in its index
+        cache.warm([args[0] for _, args in tasks], workers)
+
+    compressed = {}
+    if workers is None or workers <= 1:
+        for file_name, args in tasks:
+            try:
+                compressed[file_name] = _compress_task(*args, cache=cache)
+            except Exception as e:
+                print(f"Failed to compress {file_name}: {e}")
+    else:
+        cache_config = cache.config() if cache is not None else None
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker_cache, initargs=(cache_config,)) as executor:
+            futures = {file_name: executor.submit(_compress_task, *args) for file_name, args in tasks}
+            for file_name, future in futures.items():
+                try:
+                    compressed[file_name] = future.result()
+                except Exception as e:
+                    print(f"Failed to compress {file_name}: {e}")
+
+    manifest.update(compressed)
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+    print(f"Compressed {len(compressed)} images, skipped {skipped} up-to-date images")
+    return compressed
 
 # Example usage
 if __name__ == "__main__":
     input_dir = f"./data/original"  # Replace with your input directory path
     output_dir = f"./data/original_compressed"  # Replace with your output directory path
-    compress_images_in_directory(input_dir, output_dir, quality=10)
+    compress_images_in_directory(input_dir, output_dir, quality=10, workers=os.cpu_count())
 
 # # Example usage
 # if __name__ == "__main__":
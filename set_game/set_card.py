@@ -1,12 +1,34 @@
+import random
+import timeit
 from itertools import combinations
 
+from card_codec import FEATURES, NUM_CARDS
+
+NUM_FEATURES = 4
+
+
+def _third_card_id(a, b):
+    """Return the base-3 card id that completes a Set with cards a and b."""
+    card_id = 0
+    place = 1
+    for _ in range(NUM_FEATURES):
+        card_id += ((-(a % 3) - (b % 3)) % 3) * place
+        a //= 3
+        b //= 3
+        place *= 3
+    return card_id
+
+
+# THIRD_CARD[a][b] is the id of the only card that makes a Set with a and b
+THIRD_CARD = [[_third_card_id(a, b) for b in range(NUM_CARDS)] for a in range(NUM_CARDS)]
+
 
 def is_set(card1, card2, card3):
     """Check if three cards form a Set."""
     for feature in zip(card1, card2, card3):
         if not (
             all(f == feature[0] for f in feature)
-            or all(f != feature[0] for f in feature)
+            or len(set(feature)) == len(feature)
         ):
             return False
     return True
@@ -21,27 +43,175 @@ def find_sets(cards):
     return sets_found
 
 
-# Example usage:
-# Each card is represented as a tuple of features (number, shape, shading, color)
-cards = [
-    (1, "oval", "solid", "red"),
-    (2, "diamond", "striped", "green"),
-    (3, "squiggle", "open", "purple"),
-    # ... include all identified cards
-]
+def encode_cards(cards):
+    """
+    Encode each card as an integer in base 3, one digit per feature.
+
+    SetCard objects use their own id. Otherwise feature values are numbered
+    in order of first appearance. Any numbering works: three values are all
+    equal or all different exactly when their digits sum to 0 mod 3.
+
+    Args:
+        cards (list): SetCards or tuples of features (number, shape, shading, color).
+
+    Returns:
+        list: Card ids in 0-80, or None if the cards do not have four features
+        with at most three values each.
+    """
+    if all(isinstance(card, SetCard) for card in cards):
+        return [card.id for card in cards]
+
+    lookups = [{} for _ in range(NUM_FEATURES)]
+    card_ids = []
+    for card in cards:
+        if len(card) != NUM_FEATURES:
+            return None
+        card_id = 0
+        for lookup, value in zip(lookups, card):
+            digit = lookup.setdefault(value, len(lookup))
+            if digit > 2:
+                return None
+            card_id = card_id * 3 + digit
+        card_ids.append(card_id)
+    return card_ids
+
+
+def set_positions(card_ids):
+    """
+    Find the positions of all Sets among card ids in O(n^2).
+
+    For every pair of cards the third card of the Set is looked up in a table
+    and then in a hash of the board. Cards may repeat, as when several crops
+    of a board are recognised as the same card.
+
+    Args:
+        card_ids (list): Card ids in 0-80.
+
+    Returns:
+        list: Triples of positions (i, j, k), i < j < k, in lexicographic order.
+    """
+    positions = {}
+    for index, card_id in enumerate(card_ids):
+        positions.setdefault(card_id, []).append(index)
+
+    found = []
+    for i, card_id in enumerate(card_ids):
+        thirds = THIRD_CARD[card_id]
+        for j in range(i + 1, len(card_ids)):
+            for k in positions.get(thirds[card_ids[j]], ()):
+                if k > j:
+                    found.append((i, j, k))
+    return found
+
+
+def find_sets_fast(cards):
+    """
+    Find all Sets in the list of cards in O(n^2) with set_positions.
+
+    Returns the same triples, in the same order, as find_sets.
+
+    Args:
+        cards (list): SetCards or tuples of features (number, shape, shading, color).
 
-sets = find_sets(cards)
-print(f"Sets found: {len(sets)}")
-for s in sets:
-    print(s)
+    Returns:
+        list: Triples of cards that form a Set.
+    """
+    cards = list(cards)
+    card_ids = encode_cards(cards)
+    if card_ids is None:
+        return find_sets(cards)
+    return [(cards[i], cards[j], cards[k]) for i, j, k in set_positions(card_ids)]
+
+
+def benchmark_find_sets(board_sizes=(12, 15, 18, 21), boards=200, seed=0):
+    """
+    Time find_sets against find_sets_fast on random boards from the full deck.
+
+    Args:
+        board_sizes (tuple): Number of cards per board.
+        boards (int): Number of random boards per size.
+        seed (int): Seed for drawing the boards.
+
+    Returns:
+        dict: Board size -> (find_sets seconds, find_sets_fast seconds) per board.
+    """
+    deck = [tuple(card) for card in DECK]
+    rng = random.Random(seed)
+    results = {}
+    for size in board_sizes:
+        samples = [rng.sample(deck, size) for _ in range(boards)]
+        for sample in samples:
+            assert find_sets(sample) == find_sets_fast(sample)
+        slow = timeit.timeit(lambda: [find_sets(s) for s in samples], number=1) / boards
+        fast = timeit.timeit(lambda: [find_sets_fast(s) for s in samples], number=1) / boards
+        results[size] = (slow, fast)
+        print(f"{size} cards: find_sets {slow * 1e6:.1f} us, find_sets_fast {fast * 1e6:.1f} us, speedup {slow / fast:.1f}x")
+    return results
 
 
 class SetCard:
-    def __init__(self, number, shape, shading, color):
-        self.number = number
-        self.shape = shape
-        self.shading = shading
-        self.color = color
+    """
+    One of the 81 Set cards.
+
+    Cards are interned: constructing a card returns the shared instance for
+    those features, so cards compare and hash by identity. The id is the
+    card's position in DECK, i.e. its features read as a base-3 number.
+    """
+
+    __slots__ = ("number", "shape", "shading", "color", "id")
+
+    def __new__(cls, number, shape, shading, color):
+        try:
+            return _INTERNED[(number, shape, shading, color)]
+        except KeyError:
+            raise ValueError(f"Not a Set card: {(number, shape, shading, color)}") from None
+
+    @classmethod
+    def from_id(cls, card_id):
+        """Return the card with the given id (0-80)."""
+        return DECK[card_id]
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SetCard is immutable")
+
+    def __iter__(self):
+        return iter((self.number, self.shape, self.shading, self.color))
+
+    def __len__(self):
+        return NUM_FEATURES
+
+    def __reduce__(self):
+        return SetCard, tuple(self)
 
     def __repr__(self):
         return f"SetCard(number={self.number}, shape='{self.shape}', shading='{self.shading}', color='{self.color}')"
+
+
+def _make_card(card_id, features):
+    card = object.__new__(SetCard)
+    for name, value in zip(SetCard.__slots__, (*features, card_id)):
+        object.__setattr__(card, name, value)
+    return card
+
+
+# All 81 cards, indexed by id
+DECK = tuple(_make_card(card_id, features) for card_id, features in enumerate(FEATURES))
+_INTERNED = {tuple(card): card for card in DECK}
+
+
+# Example usage:
+if __name__ == "__main__":
+    # Each card is represented as a tuple of features (number, shape, shading, color)
+    cards = [
+        (1, "oval", "solid", "red"),
+        (2, "diamond", "striped", "green"),
+        (3, "squiggle", "open", "purple"),
+        # ... include all identified cards
+    ]
+
+    sets = find_sets_fast(cards)
+    print(f"Sets found: {len(sets)}")
+    for s in sets:
+        print(s)
+
+    benchmark_find_sets()
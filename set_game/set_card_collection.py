@@ -1,38 +1,152 @@
-from set_card import SetCard
+from set_card import DECK, THIRD_CARD, SetCard, find_sets_fast
+
+
+def _card_ids(mask):
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
 
 
 class SetCardCollection:
-    def __init__(self):
-        self.cards = []
+    """
+    A set of Set cards stored as an 81-bit integer, one bit per card id.
+
+    Adding, removing and membership tests are O(1) bit operations, and the
+    whole collection is a single int (mask), so millions of game states can
+    be held as plain integers and wrapped with from_mask when needed.
+
+    With track_sets, the collection also keeps an index of the Sets it
+    contains. Adding or removing a card only checks the pairs involving that
+    card (O(n)), and has_set, count_sets and hint are O(1).
+    """
+
+    __slots__ = ("mask", "_sets")
+
+    def __init__(self, cards=(), track_sets=False):
+        self.mask = 0
+        self._sets = {} if track_sets else None
+        for card in cards:
+            self.add_card(card)
+
+    @classmethod
+    def from_mask(cls, mask, track_sets=False):
+        """Wrap an 81-bit card mask in a collection."""
+        if track_sets:
+            return cls((DECK[card_id] for card_id in _card_ids(mask)), track_sets=True)
+        collection = cls()
+        collection.mask = mask
+        return collection
+
+    @property
+    def cards(self):
+        return list(self)
+
+    @property
+    def tracks_sets(self):
+        return self._sets is not None
 
     def add_card(self, card):
-        if isinstance(card, SetCard):
-            self.cards.append(card)
+        if not isinstance(card, SetCard) or card in self:
+            return
+        if self._sets is not None:
+            for key, triple in self._sets_with(card):
+                self._sets[key] = triple
+        self.mask |= 1 << card.id
 
     def remove_card(self, card):
-        self.cards.remove(card)
+        if card not in self:
+            raise ValueError(f"{card!r} is not in the collection")
+        self.mask ^= 1 << card.id
+        if self._sets is not None:
+            for key, _ in self._sets_with(card):
+                del self._sets[key]
+
+    def _sets_with(self, card):
+        """Yield (mask, triple) for every Set that card makes with two other cards in the collection."""
+        thirds = THIRD_CARD[card.id]
+        mask = self.mask & ~(1 << card.id)
+        for other_id in _card_ids(mask):
+            third_id = thirds[other_id]
+            # Each pair is met from both ends; keep it once
+            if third_id > other_id and (mask >> third_id) & 1:
+                key = (1 << card.id) | (1 << other_id) | (1 << third_id)
+                yield key, tuple(DECK[i] for i in sorted((card.id, other_id, third_id)))
+
+    def has_set(self):
+        """Return whether the collection contains a Set."""
+        if self._sets is None:
+            return bool(find_sets_fast(self))
+        return bool(self._sets)
+
+    def count_sets(self):
+        """Return the number of Sets in the collection."""
+        if self._sets is None:
+            return len(find_sets_fast(self))
+        return len(self._sets)
+
+    def hint(self):
+        """Return one Set in the collection as a triple of cards, or None."""
+        if self._sets is None:
+            sets = find_sets_fast(self)
+            return sets[0] if sets else None
+        return next(iter(self._sets.values()), None)
+
+    def sets(self):
+        """
+        Return all Sets in the collection as triples of cards ordered by id,
+        the triples in order of their ids (as find_sets_fast returns them).
+        """
+        if self._sets is None:
+            return find_sets_fast(self)
+        return sorted(self._sets.values(), key=lambda triple: [card.id for card in triple])
+
+    # The results of set operations track Sets if either operand does
+
+    def union(self, other):
+        return SetCardCollection.from_mask(self.mask | other.mask, self.tracks_sets or other.tracks_sets)
+
+    def intersection(self, other):
+        return SetCardCollection.from_mask(self.mask & other.mask, self.tracks_sets or other.tracks_sets)
+
+    def difference(self, other):
+        return SetCardCollection.from_mask(self.mask & ~other.mask, self.tracks_sets or other.tracks_sets)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def __contains__(self, card):
+        return isinstance(card, SetCard) and (self.mask >> card.id) & 1 == 1
+
+    def __eq__(self, other):
+        if not isinstance(other, SetCardCollection):
+            return NotImplemented
+        return self.mask == other.mask
 
     def __iter__(self):
-        return iter(self.cards)
+        for card_id in _card_ids(self.mask):
+            yield DECK[card_id]
 
     def __len__(self):
-        return len(self.cards)
+        return self.mask.bit_count()
 
     def __repr__(self):
-        return f"SetCardCollection with {len(self.cards)} cards: {self.cards}"
+        return f"SetCardCollection with {len(self)} cards: {self.cards}"
 
 
 # Example usage:
-# Create some Set cards
-card1 = SetCard(1, "oval", "solid", "red")
-card2 = SetCard(2, "squiggle", "striped", "green")
-card3 = SetCard(3, "diamond", "open", "purple")
-
-# Create a Set card collection and add cards to it
-collection = SetCardCollection()
-collection.add_card(card1)
-collection.add_card(card2)
-collection.add_card(card3)
-
-# Print the collection
-print(collection)
+if __name__ == "__main__":
+    # Create some Set cards
+    card1 = SetCard(1, "oval", "solid", "red")
+    card2 = SetCard(2, "squiggle", "striped", "green")
+    card3 = SetCard(3, "diamond", "open", "purple")
+
+    # Create a Set card collection and add cards to it
+    collection = SetCardCollection()
+    collection.add_card(card1)
+    collection.add_card(card2)
+    collection.add_card(card3)
+
+    # Print the collection
+    print(collection)
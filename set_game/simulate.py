@@ -0,0 +1,188 @@
+import csv
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from set_card import NUM_CARDS, THIRD_CARD
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BOARD_SIZE = 12
+# A board can hold at most 20 cards without a Set, so it never exceeds 21
+MAX_BOARD_SIZE = 21
+MAX_SETS_PER_GAME = NUM_CARDS // 3
+
+
+def find_set_ids(board, present):
+    """
+    Find one Set among card ids on a board.
+
+    Args:
+        board (list): Card ids on the board.
+        present (bytearray): 81 flags, set for the cards on the board.
+
+    Returns:
+        tuple: Positions (i, j, k) of a Set in board, or None.
+    """
+    size = len(board)
+    for i in range(size - 2):
+        thirds = THIRD_CARD[board[i]]
+        for j in range(i + 1, size - 1):
+            third = thirds[board[j]]
+            if present[third]:
+                return i, j, board.index(third, j + 1)
+    return None
+
+
+def play_game(deck, stats):
+    """
+    Play one game of solitaire Set and add its statistics to stats.
+
+    Twelve cards are dealt; while the board has a Set it is removed and the
+    board is refilled to twelve, otherwise three more cards are added, until
+    the deck runs out and no Set is left.
+
+    Args:
+        deck (list): Shuffled card ids.
+        stats (dict): Arrays from new_stats, updated in place.
+    """
+    board = deck[:BOARD_SIZE]
+    position = BOARD_SIZE
+    present = bytearray(NUM_CARDS)
+    for card_id in board:
+        present[card_id] = 1
+
+    sets_found = 0
+    while True:
+        found = find_set_ids(board, present)
+        # Boards after the deck ran out are covered by the leftover statistics
+        if position < len(deck):
+            stats["boards"][len(board)] += 1
+            stats["no_set"][len(board)] += found is None
+        if found is None:
+            if position == len(deck):
+                break
+            dealt = deck[position:position + 3]
+            position += 3
+            board.extend(dealt)
+            for card_id in dealt:
+                present[card_id] = 1
+            continue
+
+        sets_found += 1
+        for index in sorted(found, reverse=True):
+            present[board.pop(index)] = 0
+        if len(board) < BOARD_SIZE and position < len(deck):
+            dealt = deck[position:position + 3]
+            position += 3
+            board.extend(dealt)
+            for card_id in dealt:
+                present[card_id] = 1
+
+    stats["game_length"][sets_found] += 1
+    stats["leftover"][len(board)] += 1
+
+
+def new_stats():
+    """Return empty statistics arrays."""
+    return {
+        "boards": np.zeros(MAX_BOARD_SIZE + 1, dtype=np.int64),
+        "no_set": np.zeros(MAX_BOARD_SIZE + 1, dtype=np.int64),
+        "game_length": np.zeros(MAX_SETS_PER_GAME + 1, dtype=np.int64),
+        "leftover": np.zeros(MAX_BOARD_SIZE + 1, dtype=np.int64),
+    }
+
+
+def simulate_games(num_games, seed_sequence):
+    """
+    Play games with their own random stream.
+
+    Args:
+        num_games (int): Number of games to play.
+        seed_sequence (np.random.SeedSequence): Seed of this batch of games.
+
+    Returns:
+        dict: Statistics arrays from new_stats.
+    """
+    rng = np.random.default_rng(seed_sequence)
+    stats = new_stats()
+    for _ in range(num_games):
+        play_game(rng.permutation(NUM_CARDS).tolist(), stats)
+    return stats
+
+
+def run_simulation(num_games, seed=0, workers=None, games_per_task=1000, output_path=None):
+    """
+    Play many games across a process pool and aggregate their statistics.
+
+    Games are split into tasks, each with a child of one SeedSequence, so
+    the results depend only on seed and games_per_task, not on the number of
+    workers or the order in which tasks finish.
+
+    Args:
+        num_games (int): Total number of games.
+        seed (int): Root seed of the simulation.
+        workers (int): Number of worker processes. Defaults to the CPU count.
+        games_per_task (int): Number of games each task plays.
+        output_path (str): Optional path for the summary, written as CSV, or
+            as compressed NumPy arrays if it ends with ".npz".
+
+    Returns:
+        dict: Aggregated statistics arrays.
+    """
+    task_sizes = [min(games_per_task, num_games - start) for start in range(0, num_games, games_per_task)]
+    seeds = np.random.SeedSequence(seed).spawn(len(task_sizes))
+
+    totals = new_stats()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(simulate_games, size, child) for size, child in zip(task_sizes, seeds)]
+        for done, future in enumerate(as_completed(futures), start=1):
+            for name, counts in future.result().items():
+                totals[name] += counts
+            logger.info(f"Finished task {done}/{len(futures)}")
+    elapsed = time.perf_counter() - start
+
+    moves = int(totals["game_length"] @ np.arange(len(totals["game_length"])))
+    logger.info(f"Played {num_games} games ({moves} Sets found) in {elapsed:.1f} s")
+
+    if output_path:
+        write_summary(totals, output_path)
+    return totals
+
+
+def write_summary(stats, output_path):
+    """
+    Write aggregated statistics as CSV rows (statistic, key, count, fraction)
+    or, for a ".npz" path, as compressed NumPy arrays.
+
+    Args:
+        stats (dict): Statistics arrays from run_simulation.
+        output_path (str): Path of the summary file.
+    """
+    if output_path.endswith(".npz"):
+        np.savez_compressed(output_path, **stats)
+        return
+
+    with open(output_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["statistic", "key", "count", "fraction"])
+        for size in np.flatnonzero(stats["boards"]):
+            writer.writerow(["boards", size, stats["boards"][size], ""])
+            writer.writerow(["no_set", size, stats["no_set"][size], stats["no_set"][size] / stats["boards"][size]])
+        for name in ("game_length", "leftover"):
+            total = stats[name].sum()
+            for key in np.flatnonzero(stats[name]):
+                writer.writerow([name, key, stats[name][key], stats[name][key] / total])
+    logger.info(f"Summary saved at {output_path}")
+
+
+if __name__ == "__main__":
+    stats = run_simulation(100_000, seed=0, output_path="./simulation_summary.csv")
+    for size in np.flatnonzero(stats["boards"]):
+        logger.info(f"{size} cards: no Set in {stats['no_set'][size] / stats['boards'][size]:.4%} of boards")
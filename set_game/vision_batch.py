@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+from azure.ai.vision.imageanalysis.aio import ImageAnalysisClient
+from azure.ai.vision.imageanalysis.models import ImageAnalysisResult, VisualFeatures
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError, ServiceRequestError
+from azure.core.pipeline.transport import AioHttpTransport
+from dotenv import load_dotenv
+from PIL import Image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_FEATURES = (VisualFeatures.CAPTION, VisualFeatures.READ)
+
+# Throttling and transient server errors worth retrying
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class AnalysisCache:
+    """
+    On-disk cache of analysis results, one JSON file per image content and
+    set of options, so that an image is never sent twice.
+    """
+
+    def __init__(self, cache_directory):
+        self.directory = cache_directory
+        os.makedirs(cache_directory, exist_ok=True)
+
+    @staticmethod
+    def key(image_data, features, gender_neutral_caption):
+        """Return the cache key of an image and the analysis options."""
+        digest = hashlib.sha256(image_data).hexdigest()
+        options = "_".join(sorted(str(feature) for feature in features))
+        return f"{digest}-{options}{'-gn' if gender_neutral_caption else ''}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Return the cached result as a dictionary, or None."""
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, result):
+        """Store a result dictionary atomically."""
+        temp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(result, f)
+        os.replace(temp_path, self._path(key))
+
+
+def _retry_after(error):
+    """Return the Retry-After delay of a throttled response, in seconds, or None."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+async def analyze_image(client, image_data, features=DEFAULT_FEATURES, gender_neutral_caption=True, max_retries=5, backoff=0.5):
+    """
+    Analyze one image, retrying throttled and transient failures.
+
+    Waits for the service's Retry-After delay when given, otherwise for an
+    exponential backoff with jitter.
+
+    Args:
+        client (ImageAnalysisClient): Asynchronous client.
+        image_data (bytes): Encoded image.
+        features (tuple): VisualFeatures to request.
+        gender_neutral_caption (bool): Request gender-neutral captions.
+        max_retries (int): Retries before giving up.
+        backoff (float): First backoff delay in seconds, doubled per retry.
+
+    Returns:
+        dict: The analysis result.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            result = await client.analyze(
+                image_data=image_data,
+                visual_features=list(features),
+                gender_neutral_caption=gender_neutral_caption,
+            )
+            return result.as_dict()
+        except (HttpResponseError, ServiceRequestError) as e:
+            status = getattr(e, "status_code", None)
+            if attempt == max_retries or (isinstance(e, HttpResponseError) and status not in RETRY_STATUS_CODES):
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                delay = backoff * 2**attempt * (0.5 + random.random())
+            logger.info(f"Request failed ({status or type(e).__name__}), retrying in {delay:.2f} s")
+            await asyncio.sleep(delay)
+
+
+async def analyze_paths(image_paths, endpoint, key, features=DEFAULT_FEATURES, concurrency=8, cache_directory="./.vision_cache", gender_neutral_caption=True, max_retries=5):
+    """
+    Analyze many local images with bounded concurrency over one connection pool.
+
+    Cached results are returned without a request; new results are cached
+    as soon as they arrive. Paths with identical content in one call share a
+    single request.
+
+    Args:
+        image_paths (list): Paths to image files.
+        endpoint (str): Computer vision endpoint.
+        key (str): Computer vision key.
+        features (tuple): VisualFeatures to request.
+        concurrency (int): Largest number of requests in flight.
+        cache_directory (str): Directory of the result cache, or None.
+        gender_neutral_caption (bool): Request gender-neutral captions.
+        max_retries (int): Retries per image before giving up.
+
+    Returns:
+        dict: Path -> ImageAnalysisResult, or the exception if the image failed.
+    """
+    cache = AnalysisCache(cache_directory) if cache_directory else None
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    # Cache key -> task analysing that content, shared by every path with it
+    requests = {}
+    results = {}
+    sent = 0
+
+    def read(path):
+        with open(path, "rb") as f:
+            image_data = f.read()
+        return image_data, AnalysisCache.key(image_data, features, gender_neutral_caption)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        transport = AioHttpTransport(session=session, session_owner=False)
+        # Retries are handled by analyze_image, with the cache in mind
+        async with ImageAnalysisClient(endpoint=endpoint, credential=AzureKeyCredential(key), transport=transport, retry_total=0) as client:
+
+            async def analyze_content(image_data, cache_key):
+                nonlocal sent
+                result = cache.get(cache_key) if cache else None
+                if result is None:
+                    sent += 1
+                    result = await analyze_image(client, image_data, features, gender_neutral_caption, max_retries)
+                    if cache:
+                        cache.put(cache_key, result)
+                return result
+
+            async def analyze_path(path):
+                # Read inside the semaphore, so that at most concurrency images are in memory
+                async with semaphore:
+                    image_data, cache_key = await loop.run_in_executor(None, read, path)
+                    request = requests.get(cache_key)
+                    if request is None:
+                        request = requests[cache_key] = asyncio.ensure_future(analyze_content(image_data, cache_key))
+                        return ImageAnalysisResult(await request)
+                # A copy of an image already in flight waits for it without holding a slot
+                return ImageAnalysisResult(await request)
+
+            outcomes = await asyncio.gather(*(analyze_path(path) for path in image_paths), return_exceptions=True)
+
+    for path, outcome in zip(image_paths, outcomes):
+        results[path] = outcome
+        if isinstance(outcome, Exception):
+            logger.error(f"Analysis of {path} failed: {outcome}")
+    logger.info(f"Analyzed {len(image_paths)} images ({len(requests)} distinct), {sent} sent to the service")
+    return results
+
+
+def analyze_directory(directory_path, endpoint=None, key=None, **kwargs):
+    """
+    Analyze every image in a directory; see analyze_paths for the options.
+
+    The endpoint and key default to the VISION_ENDPOINT and VISION_KEY
+    environment variables (or .env).
+
+    Returns:
+        dict: File path -> ImageAnalysisResult, or the exception if the image failed.
+    """
+    if endpoint is None or key is None:
+        load_dotenv()
+        endpoint = endpoint or os.getenv("VISION_ENDPOINT")
+        key = key or os.getenv("VISION_KEY")
+    if not endpoint or not key:
+        raise ValueError("Missing environment variable 'VISION_ENDPOINT' or 'VISION_KEY'")
+
+    paths = [os.path.join(directory_path, name) for name in sorted(os.listdir(directory_path)) if name.lower().endswith(IMAGE_EXTENSIONS)]
+    return asyncio.run(analyze_paths(paths, endpoint, key, **kwargs))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Mimics the Image Analysis analyze operation for tests and benchmarks:
+    every throttle_every-th request is answered 429, the others with a
+    caption and an empty read result after latency seconds.
+    """
+
+    throttle_every = 0
+    latency = 0.0
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        image_data = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.lock:
+            type(self).requests += 1
+            count = type(self).requests
+
+        if self.throttle_every and count % self.throttle_every == 0:
+            self._send(429, {"error": {"code": "429", "message": "Rate limit exceeded"}}, {"Retry-After": "0"})
+            return
+
+        time.sleep(self.latency)
+        width, height = Image.open(io.BytesIO(image_data)).size
+        self._send(200, {
+            "modelVersion": "2023-10-01",
+            "metadata": {"width": width, "height": height},
+            "captionResult": {"text": "a card with shapes on it", "confidence": 0.9},
+            "readResult": {"blocks": []},
+        })
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_stand_in_server(port=0, throttle_every=0, latency=0.0):
+    """
+    Serve StandInHandler on localhost in a background thread.
+
+    Returns:
+        tuple: The server (call shutdown() when done) and its endpoint URL.
+    """
+    handler = type("Handler", (StandInHandler,), {"throttle_every": throttle_every, "latency": latency, "requests": 0})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    server, endpoint = start_stand_in_server(throttle_every=7, latency=0.1)
+    start = time.perf_counter()
+    results = analyze_directory("./data/original_compressed", endpoint, "stand-in-key", cache_directory=None)
+    logger.info(f"{len(results)} images in {time.perf_counter() - start:.2f} s against a stand-in with 0.1 s latency")
+    server.shutdown()